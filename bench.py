@@ -0,0 +1,244 @@
+# Benchmarks for design math, circuit construction, serialization and the CLI
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import emulate
+import mfb
+import pole
+from rauch import Lowpass, Bandpass, ButterworthCascade, BesselCascade
+from kicad.schema import Schematic
+from catalog import Catalog
+from options import parse_options
+from siutils import si_val, sisuffix
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+BENCHMARKS = [ ]
+
+def benchmark(name, ops = 1, setup = None):
+    '''Registers a workload.  ops is the number of operations per call,
+    used to report per-operation time.  setup, if given, is called once
+    before the workload is timed.'''
+    def register(func):
+        BENCHMARKS.append((name, ops, func, setup))
+        return func
+    return register
+
+# Workload scale; --quick divides the large ones to keep CI runs short
+SCALE = 1
+
+@benchmark("design/stage")
+def bench_stage():
+    Lowpass((0, 0), 25e3, 10.0, 0.7071, 1e3, "", True, False)
+
+@benchmark("design/butterworth8")
+def bench_butterworth8():
+    ButterworthCascade((0, 0), 25e3, 10.0, 8, 1e3, False)
+
+@benchmark("design/butterworth32")
+def bench_butterworth32():
+    ButterworthCascade((0, 0), 25e3, 10.0, 32, 1e3, False)
+
+@benchmark("design/bessel8")
+def bench_bessel8():
+    BesselCascade((0, 0), 25e3, 10.0, 8, 1e3, False)
+
+@benchmark("design/bandpass8")
+def bench_bandpass8():
+    ButterworthCascade((0, 0), 25e3, 10.0, 8, 1e3, False, stage_type = Bandpass,
+                       bandwidth = 5e3)
+
+@benchmark("design/kernel", 30000)
+def bench_kernel():
+    # 10000 stages of each topology in one call
+    topology = np.repeat(["lowpass", "highpass", "bandpass"], 10000)
+    mfb.design(topology, np.logspace(2, 5, 30000), 2.0, np.linspace(1.0, 10.0, 30000), 1e3)
+
+@benchmark("pole/chebyshev_grid")
+def bench_chebyshev_grid():
+    # Every N up to 32 against 100 ripple values
+    pole.chebyshev_grid(np.arange(1, 33)[:, None], np.linspace(0.01, 2.0, 100))
+
+CATALOG = None
+
+def setup_catalog():
+    # 10000 vetted stage designs, with the tree over them built
+    global CATALOG
+    rng = np.random.default_rng(2)
+    CATALOG = Catalog(":memory:")
+    for f0, H0, Q in zip(10.0 ** rng.uniform(1, 5, 10000), rng.uniform(1, 10, 10000),
+                         rng.uniform(0.5, 5, 10000)):
+        id, new = CATALOG.Record("stage", [f0, H0, Q, 1e3], None, 1, f0, H0, Q,
+                                 [(f0, Q, H0, ("1k", "1k", "1k", "1nF", "1nF"))])
+        CATALOG.Vet(id)
+    CATALOG.Nearest("stage", 1, 1e3, 1.0, 1.0)
+
+@benchmark("catalog/nearest", 1000, setup_catalog)
+def bench_catalog_nearest():
+    # 1000 queries
+    rng = np.random.default_rng(1)
+    for f0, H0, Q in zip(10.0 ** rng.uniform(1, 5, 1000 // SCALE),
+                         rng.uniform(1, 10, 1000 // SCALE), rng.uniform(0.5, 5, 1000 // SCALE)):
+        CATALOG.Nearest("stage", 1, f0, H0, Q)
+
+EMULATOR = None
+
+def setup_emulator():
+    global EMULATOR
+    Q, f = pole.butterworth(4)
+    EMULATOR = (emulate.SOSFilter(emulate.bilinear(np.array(f) * 10e3, Q, 1.0, 96e3), 2),
+                np.random.default_rng(1).standard_normal((1 << 20, 2)))
+
+@benchmark("emulate/butterworth4", 1 << 20, setup_emulator)
+def bench_emulate():
+    # A million stereo frames through an 8th order filter
+    filter, x = EMULATOR
+    filter.Process(x[:(1 << 20) // SCALE])
+
+LARGE_SHEET = None
+
+def setup_large_sheet():
+    global LARGE_SHEET
+    LARGE_SHEET = Schematic("A0")
+    LARGE_SHEET.Add(ButterworthCascade((0, 0), 25e3, 10.0, 32, 1e3, False))
+
+@benchmark("serialize/butterworth32", setup = setup_large_sheet)
+def bench_serialize():
+    LARGE_SHEET.ToString()
+
+@benchmark("siutils/sisuffix", 1000000)
+def bench_sisuffix():
+    n = 1000000 // SCALE
+    value = 1.234e-12
+    for i in range(n):
+        sisuffix(value)
+        value *= 1.0000276 # Sweeps 1p..1M over a million values
+
+@benchmark("siutils/si_val", 1000000)
+def bench_si_val():
+    values = ["1k", "4.7u", "100", "2.2M", "33n", "680p", "0.5m"]
+    n = 1000000 // SCALE
+    for i in range(n):
+        si_val(values[i % len(values)])
+
+def run_cli(*args):
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.check_call([sys.executable, os.path.join(HERE, "rauch.py")] + list(args) +
+                              [os.path.join(tmp, "filter.sch")],
+                              stdout=subprocess.DEVNULL, cwd=tmp)
+
+@benchmark("cli/stage")
+def bench_cli_stage():
+    run_cli("stage", "25k", "10", "0.7071", "1k")
+
+@benchmark("cli/butterworth32")
+def bench_cli_butterworth():
+    run_cli("butterworth", "25k", "10", "32", "1k")
+
+@benchmark("cli/sim_bessel8")
+def bench_cli_bessel():
+    run_cli("sim", "bessel", "25k", "10", "8", "1k")
+
+
+def measure(func, ops, repeat, min_time):
+    '''Runs func until both repeat runs and min_time seconds are done'''
+    times = [ ]
+    start = time.perf_counter()
+    while len(times) < repeat or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+        if len(times) >= 1000:
+            break
+
+    times.sort()
+    return { 'runs': len(times),
+             'min': times[0],
+             'median': times[len(times) // 2],
+             'per_op': times[0] / (ops // SCALE if ops > 1 else 1) }
+
+def revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    '''Prints the ratio of each result's min time to a previous run's'''
+    old = { }
+    with open(baseline, "r") as file:
+        for line in file:
+            record = json.loads(line)
+            if 'name' in record:
+                old[record['name']] = record
+
+    print("%-28s %12s %12s %8s" % ("benchmark", "old ms", "new ms", "ratio"))
+    for record in results:
+        prev = old.get(record['name'])
+        if prev is None:
+            continue
+        print("%-28s %12.3f %12.3f %8.2f" % (record['name'], prev['min'] * 1e3,
+                                             record['min'] * 1e3, record['min'] / prev['min']))
+
+
+if __name__ == "__main__":
+    def usage():
+        progname = os.path.split(sys.argv[0])[-1]
+
+        print("usage:")
+        print("  %s [--quick] [--repeat=N] [--out=FILE] [--compare=FILE] [name...]" % progname)
+        print()
+        print("     Runs the benchmarks whose names start with any of the given names,")
+        print("     or all of them.  Results are written as JSON lines to stdout or FILE;")
+        print("     --compare prints the ratio against an earlier results file.")
+        print("     --quick runs the per-value siutils workloads on 1/100th the values.")
+        print()
+        print("benchmarks:", " ".join(name for name, ops, func, setup in BENCHMARKS))
+        exit(1)
+
+    opts, names = parse_options(sys.argv[1:])
+
+    if "help" in opts:
+        usage()
+
+    if "quick" in opts:
+        SCALE = 100
+
+    repeat = int(opts.get("repeat") or 5)
+
+    out = sys.stdout
+    if opts.get("out"):
+        out = open(opts["out"], "w")
+
+    out.write(json.dumps({ 'revision': revision(),
+                           'python': platform.python_version(),
+                           'machine': platform.machine(),
+                           'scale': SCALE }) + "\n")
+
+    results = [ ]
+    for name, ops, func, setup in BENCHMARKS:
+        if len(names) > 0 and not any(name.startswith(n) for n in names):
+            continue
+
+        if setup is not None:
+            setup()
+        record = measure(func, ops, repeat, 0.2)
+        record['name'] = name
+        results.append(record)
+        out.write(json.dumps(record, sort_keys=True) + "\n")
+        out.flush()
+
+    if out is not sys.stdout:
+        out.close()
+
+    if opts.get("compare"):
+        compare(results, opts["compare"])
@@ -0,0 +1,136 @@
+# Content-addressed on-disk cache for generated schematics
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Binary size suffixes, so 64M is the same as the default
+SIZE_SUFFIXES = { "k": 1 << 10, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30 }
+
+SCH_SUFFIX    = ".sch"
+REPORT_SUFFIX = ".txt"
+
+
+def parse_size(text):
+    '''Parses a byte count with an optional binary suffix: 64M is 64MiB'''
+    number, scale = text, 1
+    if text[-1:] in SIZE_SUFFIXES:
+        number, scale = text[:-1], SIZE_SUFFIXES[text[-1]]
+    try:
+        return int(float(number) * scale)
+    except ValueError:
+        raise ValueError("Bad cache size %s" % text)
+
+
+class SchematicCache(object):
+    '''Caches finished .sch files and their component reports in a directory.
+
+    Entries are keyed by a hash of the canonical filter spec, the tool
+    version and the serializer backend, so any change to either of the
+    latter invalidates everything.  The directory is bounded to max_bytes;
+    least recently used entries (by mtime, which is refreshed on every hit)
+    are evicted first.'''
+
+    def __init__(self, path, version, backend, max_bytes = DEFAULT_MAX_BYTES):
+        self.path      = path
+        self.version   = version
+        self.backend   = backend
+        self.max_bytes = max_bytes
+
+        os.makedirs(path, exist_ok=True)
+
+    def Key(self, spec):
+        '''Returns the cache key for a spec, which must be JSON serializable'''
+        canonical = json.dumps({ 'spec': spec,
+                                 'version': self.version,
+                                 'backend': self.backend },
+                               sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def entryPath(self, key, suffix):
+        return os.path.join(self.path, key + suffix)
+
+    def Fetch(self, key, filename, link = False):
+        '''Places a cached schematic at filename and returns its report,
+        or None on a miss.  With link the file is hard linked rather than
+        copied; only do this if the output won't be edited in place.'''
+        sch    = self.entryPath(key, SCH_SUFFIX)
+        report = self.entryPath(key, REPORT_SUFFIX)
+
+        try:
+            with open(report, "r") as file:
+                text = file.read()
+
+            if os.path.lexists(filename):
+                os.remove(filename)
+
+            copied = False
+            if link:
+                try:
+                    os.link(sch, filename)
+                    copied = True
+                except OSError:
+                    pass # Cross-device or unsupported, fall back on copying
+            if not copied:
+                shutil.copyfile(sch, filename)
+
+            # Refresh the LRU timestamp
+            os.utime(sch, None)
+            os.utime(report, None)
+        except (IOError, OSError):
+            return None
+
+        return text
+
+    def Store(self, key, filename, report):
+        '''Adds a finished schematic and its report to the cache'''
+        self.writeAtomic(self.entryPath(key, REPORT_SUFFIX), report.encode('utf-8'))
+
+        with open(filename, "rb") as file:
+            self.writeAtomic(self.entryPath(key, SCH_SUFFIX), file.read())
+
+        self.Evict()
+
+    def writeAtomic(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def Entries(self):
+        '''Returns a list of (mtime, size, key) tuples, one per cache entry'''
+        entries = { }
+        for name in os.listdir(self.path):
+            key, suffix = os.path.splitext(name)
+            if not suffix in [SCH_SUFFIX, REPORT_SUFFIX]:
+                continue
+
+            st = os.stat(os.path.join(self.path, name))
+            mtime, size = entries.get(key, (0, 0))
+            entries[key] = (max(mtime, st.st_mtime), size + st.st_size)
+
+        return [(mtime, size, key) for key, (mtime, size) in entries.items()]
+
+    def Evict(self):
+        '''Removes least recently used entries until within max_bytes'''
+        entries = sorted(self.Entries())
+        total = sum(size for mtime, size, key in entries)
+
+        for mtime, size, key in entries:
+            if total <= self.max_bytes:
+                break
+
+            for suffix in [SCH_SUFFIX, REPORT_SUFFIX]:
+                try:
+                    os.remove(self.entryPath(key, suffix))
+                except OSError:
+                    pass
+            total -= size
@@ -0,0 +1,252 @@
+# Catalog of generated designs, with nearest vetted design lookup
+#
+# Every design is recorded in an SQLite database with its spec and the
+# values of each stage.  Designs someone has qualified are marked vetted,
+# and a k-d tree over (log10 f0, H0, Q) of the vetted designs answers
+# "closest vetted design to this spec".  Designs are only compared with
+# others of the same kind and number of stages; Q is the stage Q for a
+# single stage and the highest stage Q of a cascade, which for a given
+# kind and N only varies with e.g. Chebyshev ripple.
+
+import json
+import math
+import sqlite3
+import sys
+import time
+
+from siutils import sisuffix, nsigdig
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS designs (
+    id      INTEGER PRIMARY KEY,
+    kind    TEXT NOT NULL,
+    n       INTEGER NOT NULL,
+    f0      REAL NOT NULL,
+    h0      REAL NOT NULL,
+    q       REAL NOT NULL,
+    spec    TEXT NOT NULL UNIQUE,
+    vetted  INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    design  INTEGER NOT NULL REFERENCES designs(id),
+    number  INTEGER NOT NULL,
+    f0      REAL NOT NULL,
+    q       REAL NOT NULL,
+    h0      REAL NOT NULL,
+    r1      TEXT NOT NULL,
+    r2      TEXT NOT NULL,
+    r3      TEXT NOT NULL,
+    c1      TEXT NOT NULL,
+    c2      TEXT NOT NULL,
+    PRIMARY KEY (design, number)
+);
+'''
+
+DEFAULT_PATH = "filtergen-catalog.db"
+
+
+class KDTree(object):
+    '''A static k-d tree over a list of equal length point tuples'''
+
+    def __init__(self, points):
+        self.points = [tuple(float(x) for x in p) for p in points]
+        self.k      = len(self.points[0]) if len(self.points) > 0 else 0
+        self.root   = self.build(list(range(len(self.points))), 0)
+
+    def build(self, indices, depth):
+        '''Nodes are (point index, axis, left, right) tuples'''
+        if len(indices) == 0:
+            return None
+        axis = depth % self.k
+        indices.sort(key=lambda i: self.points[i][axis])
+        mid = len(indices) // 2
+        return (indices[mid], axis,
+                self.build(indices[:mid], depth + 1),
+                self.build(indices[mid+1:], depth + 1))
+
+    def Nearest(self, point):
+        '''Returns (distance, index) of the nearest point, or None if empty'''
+        if self.root is None:
+            return None
+
+        point = tuple(float(x) for x in point)
+        best = [math.inf, None]
+
+        def search(node):
+            index, axis, left, right = node
+            p = self.points[index]
+            d = sum((a - b) * (a - b) for a, b in zip(point, p))
+            if d < best[0]:
+                best[0], best[1] = d, index
+
+            diff = point[axis] - p[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            if near is not None:
+                search(near)
+            if far is not None and diff * diff < best[0]:
+                search(far)
+
+        search(self.root)
+        return math.sqrt(best[0]), best[1]
+
+
+def design_point(f0, H0, Q):
+    return (math.log10(f0), H0, Q)
+
+
+class Design(object):
+    '''A catalog row.  spec is a dict with the CLI mode, its numeric args,
+    the op amp the values were predistorted for, if any, and arrange:
+    false for designs made with --no-arrange.'''
+
+    def __init__(self, row):
+        self.id, self.kind, self.n, self.f0, self.H0, self.Q, spec, vetted, self.created = row
+        self.spec   = json.loads(spec)
+        self.vetted = bool(vetted)
+
+    def Describe(self):
+        args = " ".join(sisuffix(arg) for arg in self.spec['args'])
+        s = "#%d %s %s" % (self.id, self.spec['mode'], args)
+        if self.spec.get('predistort'):
+            s += " (for %s)" % self.spec['predistort']
+        if not self.spec.get('arrange', True):
+            s += " (no-arrange)"
+        if self.vetted:
+            s += ", vetted"
+        return s
+
+
+class Catalog(object):
+    def __init__(self, path = DEFAULT_PATH):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.trees = { }  # (kind, n) -> (KDTree, [design ids])
+
+    def Close(self):
+        self.db.close()
+
+    @staticmethod
+    def Spec(mode, args, predistort, arrange = True):
+        '''The spec dict of a design, as Design.spec has it.  arrange is
+        only recorded when false, so arranged designs keep the specs they
+        were recorded with before it was.'''
+        spec = { 'mode': mode, 'args': [float(a) for a in args], 'predistort': predistort }
+        if not arrange:
+            spec['arrange'] = False
+        return spec
+
+    def Record(self, mode, args, predistort, n, f0, H0, Q, stages, arrange = True):
+        '''Records a design unless its spec is already there.  stages is a
+        list of (f0, Q, H0, (R1, R2, R3, C1, C2) value strings).  Returns
+        (id, new).'''
+        spec = json.dumps(self.Spec(mode, args, predistort, arrange), sort_keys=True)
+        with self.db:
+            row = self.db.execute("SELECT id FROM designs WHERE spec = ?", (spec, )).fetchone()
+            if row is not None:
+                return row[0], False
+
+            cursor = self.db.execute(
+                "INSERT INTO designs (kind, n, f0, h0, q, spec, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (mode, int(n), float(f0), float(H0), float(Q), spec, time.time()))
+            design = cursor.lastrowid
+            self.db.executemany(
+                "INSERT INTO stages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(design, i + 1, float(sf), float(sq), float(sh)) + tuple(values)
+                 for i, (sf, sq, sh, values) in enumerate(stages)])
+        return design, True
+
+    def Vet(self, design, vetted = True):
+        '''Marks a design as vetted (or not).  Returns False if there's no
+        such design.'''
+        with self.db:
+            cursor = self.db.execute("UPDATE designs SET vetted = ? WHERE id = ?",
+                                     (int(vetted), design))
+        self.trees.clear()
+        return cursor.rowcount > 0
+
+    def Get(self, design):
+        row = self.db.execute("SELECT * FROM designs WHERE id = ?", (design, )).fetchone()
+        return None if row is None else Design(row)
+
+    def Designs(self, vetted_only = False):
+        query = "SELECT * FROM designs"
+        if vetted_only:
+            query += " WHERE vetted"
+        return [Design(row) for row in self.db.execute(query + " ORDER BY id")]
+
+    def Stages(self, design):
+        '''Returns a list of (f0, Q, H0, (R1, R2, R3, C1, C2)) in stage order'''
+        return [(f0, q, h0, tuple(values)) for f0, q, h0, *values in self.db.execute(
+            "SELECT f0, q, h0, r1, r2, r3, c1, c2 FROM stages WHERE design = ? "
+            "ORDER BY number", (design, ))]
+
+    def tree(self, kind, n):
+        key = (kind, int(n))
+        if not key in self.trees:
+            rows = self.db.execute("SELECT id, f0, h0, q FROM designs "
+                                   "WHERE vetted AND kind = ? AND n = ?", key).fetchall()
+            self.trees[key] = (KDTree([design_point(f0, h0, q) for id, f0, h0, q in rows]),
+                               [row[0] for row in rows])
+        return self.trees[key]
+
+    def Nearest(self, kind, n, f0, H0, Q):
+        '''Returns (distance, Design) for the vetted design of a kind and
+        stage count nearest to a spec, or None'''
+        tree, ids = self.tree(kind, n)
+        found = tree.Nearest(design_point(f0, H0, Q))
+        if found is None:
+            return None
+        distance, index = found
+        return distance, self.Get(ids[index])
+
+
+if __name__ == "__main__":
+    import os
+
+    from options import parse_options
+
+    def usage():
+        progname = os.path.split(sys.argv[0])[-1]
+
+        print("usage:")
+        print("  %s [--catalog=DB] list [--vetted]" % progname)
+        print("  %s [--catalog=DB] show ID" % progname)
+        print("  %s [--catalog=DB] vet ID..." % progname)
+        print("  %s [--catalog=DB] unvet ID..." % progname)
+        print()
+        print("     Lists, shows and vets the designs rauch.py --catalog recorded.")
+        print("     The catalog defaults to %s." % DEFAULT_PATH)
+        exit(1)
+
+    opts, argv = parse_options(sys.argv[1:])
+
+    if len(argv) < 1 or "help" in opts:
+        usage()
+
+    catalog = Catalog(opts.get("catalog") or DEFAULT_PATH)
+    what = argv[0]
+
+    if what == "list":
+        for design in catalog.Designs("vetted" in opts):
+            print(design.Describe())
+    elif what == "show" and len(argv) == 2:
+        design = catalog.Get(int(argv[1]))
+        if design is None:
+            print("No design %s" % argv[1])
+            exit(1)
+        print(design.Describe())
+        for i, (f0, Q, H0, values) in enumerate(catalog.Stages(design.id)):
+            print("  stage #%d  f0 %sHz  Q %s  H0 %s" % (i + 1, sisuffix(f0), nsigdig(Q, 4),
+                                                         nsigdig(H0, 4)))
+            print("    R1 %sohm  R2 %sohm  R3 %sohm  C1 %s  C2 %s" % values)
+    elif what in ["vet", "unvet"] and len(argv) >= 2:
+        for id in argv[1:]:
+            if not catalog.Vet(int(id), what == "vet"):
+                print("No design %s" % id)
+                exit(1)
+    else:
+        usage()
+
+    catalog.Close()
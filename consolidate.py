@@ -0,0 +1,373 @@
+# Family-wide BOM consolidation
+#
+# Given the filters of a product family, picks R1 and E series values for
+# every stage so that the whole family uses as few distinct part values
+# as possible, with every stage's realized f0, Q and H0 within tolerance.
+#
+# Each stage's options come from every R1 on the resistor series in range
+# and every combination of rounding R2, R3, C1 and C2 down or up, kept if
+# within tolerance.  Each option is a bitmask over all part values seen,
+# so a family's BOM is the OR of its options.  Identical stages share
+# one choice, options that need a superset of another option's values are
+# dropped, and a branch and bound search over the rest finds the smallest
+# BOM.  The first stage's options are searched in parallel, sharing the
+# best count found so far for pruning.
+
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+import eseries
+import headroom
+import mfb
+import pole
+from options import parse_options
+from siutils import si_val, si_val_or_pct, sisuffix, nsigdig
+
+R_SERIES = "E24"
+C_SERIES = "E12"
+F_TOL = 0.02
+Q_TOL = 0.03
+H_TOL = 0.02
+R1_MIN = 1e3
+R1_MAX = 100e3
+C_MIN = 10e-12
+C_MAX = 10e-6
+STEPS = 1
+MAX_NODES = 10000
+
+# Mode: (number of arguments, stage (Q list, f multiplier list) from them)
+FAMILIES = { "stage":          (3, lambda args: ([args[2]], [1.0])),
+             "butterworth":    (3, lambda args: pole.butterworth(args[2])),
+             "bessel":         (3, lambda args: pole.bessel(args[2])),
+             "chebyshev":      (4, lambda args: pole.chebyshev(args[2], args[3])),
+             "linkwitz-riley": (3, lambda args: pole.linkwitz_riley(args[2])),
+             "critical":       (3, lambda args: pole.critically_damped(args[2])) }
+
+
+def bits(mask):
+    return bin(mask).count("1")
+
+def spec_stages(words):
+    '''Returns the (f0, Q, H0) stage targets for a spec such as
+    "butterworth 10k 2 4", arranged as a Cascade would'''
+    if len(words) < 1 or not words[0] in FAMILIES or len(words) != FAMILIES[words[0]][0] + 1:
+        raise ValueError("bad spec '%s'" % " ".join(words))
+    args = [si_val(w) for w in words[1:]]
+    Qlist, flist = FAMILIES[words[0]][1](args)
+    f0 = [args[0] * f for f in flist[:len(Qlist)]]
+    order, gains, peaks = headroom.arrange(f0, Qlist, args[1])
+    return [(f0[k], Qlist[k], float(H)) for k, H in zip(order, gains)]
+
+
+class Tolerances(object):
+    def __init__(self, f = F_TOL, Q = Q_TOL, H = H_TOL):
+        self.f = f
+        self.Q = Q
+        self.H = H
+
+
+class Options(object):
+    '''The ways of building one distinct stage.  choices are (R1, R2, R3,
+    C1, C2) series positions and errors are the worst relative error of
+    each, both in the order of masks.'''
+
+    def __init__(self, target, masks, choices, errors):
+        self.target  = target
+        self.masks   = masks
+        self.choices = choices
+        self.errors  = errors
+
+
+def stage_options(targets, rseries, cseries, tol, r1_min = R1_MIN, r1_max = R1_MAX,
+                  steps = STEPS):
+    '''Finds the options of each distinct stage target, vectorized over
+    targets, R1 values and roundings.  Returns (list of Options, list of
+    ("R" or "C", position) per mask bit).'''
+    targets = np.array(targets, dtype=float).reshape(-1, 3)
+    f0, Q, H0 = [targets[:, i, None, None] for i in range(3)]
+
+    r1 = eseries.between(rseries, r1_min, r1_max)[None, :, None]
+    R1 = eseries.value(rseries, r1)
+    ideal = mfb.lowpass_design(f0, H0, Q, R1)
+
+    # R2, R3, C1 and C2 each try the series values bracketing their ideal
+    # value and STEPS more either side, in every combination
+    offsets = np.arange(-steps, steps + 2)
+    combos = np.indices((len(offsets), ) * 4).reshape(4, -1)
+    positions = [np.broadcast_to(r1, f0.shape[:1] + r1.shape[1:2] + combos.shape[1:])]
+    for k, (series, x) in enumerate(zip([rseries, rseries, cseries, cseries], ideal[1:])):
+        lower = eseries.bracket(series, x)[0]
+        positions.append(lower + offsets[combos[k]])
+    positions = np.broadcast_arrays(*positions)
+
+    values = [eseries.value(rseries if k < 3 else cseries, p) for k, p in enumerate(positions)]
+    f, q, h = mfb.lowpass_response(*values)
+    errors = np.maximum.reduce([np.abs(f / f0 - 1.0) / tol.f, np.abs(q / Q - 1.0) / tol.Q,
+                                np.abs(h / H0 - 1.0) / tol.H])
+    ok = (errors <= 1.0) & (values[3] >= C_MIN) & (values[3] <= C_MAX) & \
+         (values[4] >= C_MIN) & (values[4] <= C_MAX)
+
+    # Number the part values used by any option
+    parts  = { }
+    labels = [ ]
+    def bit(part):
+        if not part in parts:
+            parts[part] = len(labels)
+            labels.append(part)
+        return 1 << parts[part]
+
+    stages = [ ]
+    for s in range(len(targets)):
+        best = { }  # mask -> (error, choice)
+        for i, c in zip(*np.nonzero(ok[s])):
+            choice = tuple(int(p[s, i, c]) for p in positions)
+            mask = bit(("R", choice[0])) | bit(("R", choice[1])) | bit(("R", choice[2])) | \
+                   bit(("C", choice[3])) | bit(("C", choice[4]))
+            error = float(errors[s, i, c])
+            if not mask in best or error < best[mask][0]:
+                best[mask] = (error, choice)
+
+        # Drop options needing a superset of another's values
+        masks = sorted(best.keys(), key=lambda m: (bits(m), best[m][0]))
+        kept = [ ]
+        for m in masks:
+            if not any(k & m == k for k in kept):
+                kept.append(m)
+
+        stages.append(Options(tuple(targets[s]), kept, [best[m][1] for m in kept],
+                              [best[m][0] for m in kept]))
+    return stages, labels
+
+
+# Search state, set up per process by init_search
+SEARCH = { }
+
+def init_search(options, rmask, best, max_nodes):
+    SEARCH['options']   = options
+    SEARCH['rmask']     = rmask
+    SEARCH['best']      = best
+    SEARCH['max_nodes'] = max_nodes
+
+def lower_bound(used, i):
+    '''Values used so far, plus the most new resistors any remaining stage
+    must add, plus the most new capacitors'''
+    new_r = SEARCH['rmask'] & ~used
+    new_c = ~SEARCH['rmask'] & ~used
+    need_r = need_c = 0
+    for masks in SEARCH['options'][i:]:
+        need_r = max(need_r, min(bits(m & new_r) for m in masks))
+        need_c = max(need_c, min(bits(m & new_c) for m in masks))
+    return bits(used) + need_r + need_c
+
+def search_from(first):
+    '''Depth first branch and bound with the first stage's option fixed.
+    Returns (count, option index per stage, exhausted), count None if
+    nothing beat the shared best.'''
+    options = SEARCH['options']
+    best = SEARCH['best']
+    found = [None, None]
+    nodes = [0]
+    path = [first]
+
+    def dfs(i, used):
+        nodes[0] += 1
+        if nodes[0] > SEARCH['max_nodes']:
+            return
+        if i == len(options):
+            count = bits(used)
+            with best.get_lock():
+                if count < best.value:
+                    best.value = count
+                    found[0], found[1] = count, list(path)
+            return
+        if lower_bound(used, i) >= best.value:
+            return
+        for j in sorted(range(len(options[i])), key=lambda j: bits(options[i][j] & ~used)):
+            path.append(j)
+            dfs(i + 1, used | options[i][j])
+            path.pop()
+
+    dfs(1, options[0][first])
+    return found[0], found[1], nodes[0] <= SEARCH['max_nodes']
+
+def greedy(options, first):
+    '''Starting from one of the first stage's options, picks the option
+    adding fewest new values stage by stage, then re-picks each stage's
+    option given all the others' until nothing improves'''
+    used = options[0][first]
+    path = [first]
+    for masks in options[1:]:
+        j = min(range(len(masks)), key=lambda j: bits(masks[j] & ~used))
+        path.append(j)
+        used |= masks[j]
+
+    improved = True
+    while improved:
+        improved = False
+        for i, masks in enumerate(options[1:], 1):
+            others = 0
+            for k, j in enumerate(path):
+                if k != i:
+                    others |= options[k][j]
+            j = min(range(len(masks)), key=lambda j: bits(masks[j] | others))
+            if bits(masks[j] | others) < bits(masks[path[i]] | others):
+                path[i] = j
+                improved = True
+
+    used = 0
+    for masks, j in zip(options, path):
+        used |= masks[j]
+    return bits(used), path
+
+def optimize(stages, labels, jobs = None, max_nodes = MAX_NODES):
+    '''Chooses one option per stage, searching from each of the first
+    stage's options with up to max_nodes nodes each.  Returns (count,
+    option index per stage, proven optimal).'''
+    # Stages with the fewest options first, which narrows the tree early
+    order = sorted(range(len(stages)), key=lambda s: len(stages[s].masks))
+    options = [stages[s].masks for s in order]
+    rmask = sum(1 << b for b, (kind, p) in enumerate(labels) if kind == "R")
+
+    firsts = range(len(options[0]))
+    count, path = min(greedy(options, j) for j in firsts)
+    best = multiprocessing.Value('i', count)
+
+    if jobs == 1:
+        init_search(options, rmask, best, max_nodes)
+        results = [search_from(j) for j in firsts]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_search,
+                                 initargs=(options, rmask, best, max_nodes)) as pool:
+            results = list(pool.map(search_from, firsts))
+
+    proven = all(exhausted for found, rest, exhausted in results)
+    for found, rest, exhausted in results:
+        if found is not None and found <= count:
+            count, path = found, rest
+
+    chosen = [None] * len(stages)
+    for s, j in zip(order, path):
+        chosen[s] = j
+    return count, chosen, proven
+
+def independent_count(targets, rseries, cseries, r1):
+    '''Distinct values when every stage uses R1 = r1 and rounds to the
+    nearest values on its own, for comparison'''
+    f0, Q, H0 = np.array(targets, dtype=float).reshape(-1, 3).T
+    R1, R2, R3, C1, C2 = mfb.lowpass_design(f0, H0, Q, eseries.value(rseries, eseries.snap(rseries, r1)))
+    resistors = set(np.concatenate([eseries.snap(rseries, v) for v in (R1, R2, R3)]).tolist())
+    capacitors = set(np.concatenate([eseries.snap(cseries, v) for v in (C1, C2)]).tolist())
+    return len(resistors) + len(capacitors)
+
+
+if __name__ == "__main__":
+    def usage():
+        progname = os.path.split(sys.argv[0])[-1]
+
+        print("usage:")
+        print("  %s [options] SPECFILE..." % progname)
+        print()
+        print("options:")
+        print("  --series=E24        resistor series (default %s)" % R_SERIES)
+        print("  --cap-series=E12    capacitor series (default %s)" % C_SERIES)
+        print("  --f-tol=2%          allowed f0 error (default %s%%)" % nsigdig(F_TOL * 100, 3))
+        print("  --q-tol=3%          allowed Q error (default %s%%)" % nsigdig(Q_TOL * 100, 3))
+        print("  --h-tol=2%          allowed H0 error (default %s%%)" % nsigdig(H_TOL * 100, 3))
+        print("  --r1=MIN:MAX        range of R1 values to try (default %s:%s)" % (
+            sisuffix(R1_MIN), sisuffix(R1_MAX)))
+        print("  --steps=N           series steps to try past the nearest values (default %d)" % STEPS)
+        print("  --max-nodes=N       search effort per first stage option (default %s)" % sisuffix(MAX_NODES))
+        print("  --jobs=N            search with N processes (default: one per CPU)")
+        print()
+        print("     Chooses R1 and E series values for every stage of a family of filters,")
+        print("     minimizing the number of distinct part values with every stage within")
+        print("     tolerance.  Spec files have one filter per line, as the rauch.py")
+        print("     arguments without R1 and filename, e.g.")
+        print()
+        print("       butterworth 10k 2 4")
+        print("       chebyshev 3k 1 3 0.5")
+        exit(1)
+
+    opts, argv = parse_options(sys.argv[1:])
+
+    if len(argv) < 1 or "help" in opts:
+        usage()
+
+    rseries = opts.get("series") or R_SERIES
+    cseries = opts.get("cap-series") or C_SERIES
+    tol = Tolerances(si_val_or_pct(opts.get("f-tol") or str(F_TOL), 1.0),
+                     si_val_or_pct(opts.get("q-tol") or str(Q_TOL), 1.0),
+                     si_val_or_pct(opts.get("h-tol") or str(H_TOL), 1.0))
+    r1_min, r1_max = R1_MIN, R1_MAX
+    if opts.get("r1"):
+        r1_min, r1_max = [si_val(v) for v in opts["r1"].split(":")]
+    jobs = int(opts["jobs"]) if opts.get("jobs") else None
+    steps = int(opts["steps"]) if opts.get("steps") else STEPS
+    max_nodes = int(si_val(opts["max-nodes"])) if opts.get("max-nodes") else MAX_NODES
+
+    # Read the specs, and number the distinct stage targets
+    specs = [ ]
+    targets = [ ]
+    target_index = { }
+    try:
+        for name in argv:
+            with open(name) as file:
+                for line in file:
+                    words = line.split("#")[0].split()
+                    if len(words) == 0:
+                        continue
+                    stages = [ ]
+                    for target in spec_stages(words):
+                        key = tuple(round(float(t), 9) for t in target)
+                        if not key in target_index:
+                            target_index[key] = len(targets)
+                            targets.append(target)
+                        stages.append(target_index[key])
+                    specs.append((" ".join(words), stages))
+        options, labels = stage_options(targets, rseries, cseries, tol, r1_min, r1_max, steps)
+    except (OSError, ValueError) as e:
+        print("Error: %s" % e)
+        exit(1)
+
+    for spec, stages in specs:
+        for i, s in enumerate(stages):
+            if len(options[s].masks) == 0:
+                print("No values meet the tolerances for %s stage #%d; try a finer series," % (
+                    spec, i + 1))
+                print("looser tolerances or a wider R1 range")
+                exit(1)
+
+    count, chosen, proven = optimize(options, labels, jobs, max_nodes)
+
+    print("%d filters, %d distinct stages, %d options after pruning" % (
+        len(specs), len(targets), sum(len(o.masks) for o in options)))
+    print("Distinct values: %d%s (rounding each stage on its own at R1=10k: %d)" % (
+        count, "" if proven else ", search cut short", independent_count(
+            targets, rseries, cseries, 10e3)))
+
+    names = ["R1", "R2", "R3", "C1", "C2"]
+    uses = { }
+    for spec, stages in specs:
+        print("\n%s:" % spec)
+        for i, s in enumerate(stages):
+            choice = options[s].choices[chosen[s]]
+            values = [eseries.value(rseries if k < 3 else cseries, p)
+                      for k, p in enumerate(choice)]
+            f, q, h = mfb.lowpass_response(*values)
+            f0, Q, H0 = options[s].target
+            print("  stage #%d  %s  f0 %+.2f%%  Q %+.2f%%  H0 %+.2f%%" % (
+                i + 1, "  ".join("%s %s%s" % (name, sisuffix(v), "F" if name[0] == "C" else "")
+                                 for name, v in zip(names, values)),
+                (f / f0 - 1) * 100, (q / Q - 1) * 100, (h / H0 - 1) * 100))
+            for k, p in enumerate(choice):
+                part = ("R" if k < 3 else "C", p)
+                uses[part] = uses.get(part, 0) + 1
+
+    print("\nConsolidated BOM, one of each filter:")
+    for kind, p in sorted(uses.keys()):
+        v = eseries.value(rseries if kind == "R" else cseries, p)
+        print("  %s %-8s x%d" % (kind, sisuffix(v) + ("F" if kind == "C" else ""), uses[(kind, p)]))
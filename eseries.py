@@ -0,0 +1,60 @@
+# IEC 60063 preferred number series
+#
+# E3 to E24 are tabulated, since a few of their values don't follow the
+# formula.  E48 and E96 are 10^(i/n) rounded to three digits.  Values are
+# handled as integer positions on the series, counting up from 1 (or
+# 1.0) at position 0, so any two equal values get the same position.
+
+import numpy as np
+
+E24 = [1.0, 1.1, 1.2, 1.3, 1.5, 1.6, 1.8, 2.0, 2.2, 2.4, 2.7, 3.0,
+       3.3, 3.6, 3.9, 4.3, 4.7, 5.1, 5.6, 6.2, 6.8, 7.5, 8.2, 9.1]
+
+SERIES = { "E3":  E24[::8],
+           "E6":  E24[::4],
+           "E12": E24[::2],
+           "E24": E24,
+           "E48": [round(10.0 ** (i / 48.0), 2) for i in range(48)],
+           "E96": [round(10.0 ** (i / 96.0), 2) for i in range(96)] }
+
+
+def mantissas(series):
+    '''Returns the values of a series within a decade, as an array'''
+    if not series in SERIES:
+        raise ValueError("Unknown series %s; known ones are %s" % (
+            series, " ".join(sorted(SERIES.keys()))))
+    return np.array(SERIES[series])
+
+def value(series, position):
+    '''The value at integer positions on a series'''
+    m = mantissas(series)
+    position = np.asarray(position)
+    decade, index = np.divmod(position, len(m))
+    return m[index] * 10.0 ** decade
+
+def bracket(series, x):
+    '''Positions of the series values just below and above x (equal if x
+    is on the series)'''
+    m = mantissas(series)
+    x = np.asarray(x, dtype=float)
+    decade = np.floor(np.log10(x))
+    mant = x / 10.0 ** decade
+
+    # Last mantissa <= x, allowing for rounding of x itself
+    index = np.searchsorted(m, mant * (1.0 + 1e-9), side='right') - 1
+    lower = decade.astype(int) * len(m) + index
+    exact = np.isclose(value(series, lower), x, rtol=1e-9)
+    return lower, np.where(exact, lower, lower + 1)
+
+def snap(series, x):
+    '''Positions of the series values nearest x on a log scale'''
+    lower, upper = bracket(series, x)
+    x = np.asarray(x, dtype=float)
+    nearer_lower = np.log(x / value(series, lower)) <= np.log(value(series, upper) / x)
+    return np.where(nearer_lower, lower, upper)
+
+def between(series, lo, hi):
+    '''Positions of all series values from lo to hi inclusive'''
+    first = bracket(series, lo)[1]
+    last  = bracket(series, hi)[0]
+    return np.arange(int(first), int(last) + 1)
@@ -0,0 +1,177 @@
+# Headroom-aware stage ordering and gain distribution for cascades
+#
+# With the stages in some order, the peak gain from the filter input to
+# each stage's output is the peak over frequency of the product of the
+# stages so far.  An internal node peaking higher than the output clips
+# first, wasting headroom.  Since the stages commute, that peak depends
+# only on which stages come first, not their order, so the best order
+# minimizes the highest peak along a chain of growing stage subsets: a
+# shortest path over the subset lattice for up to EXHAUSTIVE stages, and
+# built greedily beyond that.
+#
+# Gain then goes as early as the worst peak allows, which is best for
+# noise: the cumulative gain at each stage is as high as it can be
+# without any node, that one or later, peaking above the worst one.
+# Each stage's gain stays under its limit (see mfb.gain_limit), and the
+# cumulative gain stays between 1 and H0 (H0 and 1 for H0 < 1), except
+# that it drops as low as it must for the later stages to reach H0
+# within their limits.  Band-pass cumulative gains may go below 1, since
+# stages with Q under 0.7 can't even reach a gain of 1.
+#
+# Stages are scaled to a peak gain of 1 in their passband: at DC for
+# low-pass, at infinity for high-pass, and at its own centre for a
+# band-pass stage.  A band-pass cascade's stages don't share a centre,
+# so passband_gain() gives what H0 must be divided by to get the
+# product of their gains.
+
+import numpy as np
+
+NPOINTS = 1024
+EXHAUSTIVE = 10
+# Relative peak improvement needed to move away from the default order
+MARGIN = 1e-6
+
+
+def stage_log_magnitudes(f, f0, Q, topology = "lowpass"):
+    '''ln |H(j f)| of unit gain stages, shaped (stages, frequencies)'''
+    f0 = np.asarray(f0, dtype=float)
+    Q  = np.asarray(Q, dtype=float)
+    x  = np.asarray(f, dtype=float)[None, :] / f0[:, None]
+    if topology == "highpass":
+        x = 1.0 / x # The low-pass response, mirrored about f0
+    logH = -0.5 * np.log((1.0 - x**2)**2 + (x / Q[:, None])**2)
+    if topology == "bandpass":
+        logH += np.log(x / Q[:, None])
+    return logH
+
+def log_magnitudes(f0, Q, npoints = NPOINTS, topology = "lowpass"):
+    '''ln |H(j f)| of unit gain stages over a grid from a decade below the
+    lowest f0 to a decade above the highest, shaped (stages, npoints),
+    plus the flat passband of low-pass and high-pass stages'''
+    f0 = np.asarray(f0, dtype=float)
+    f  = np.logspace(np.log10(f0.min()) - 1, np.log10(f0.max()) + 1, npoints)
+    logH = stage_log_magnitudes(f, f0, Q, topology)
+    if topology == "bandpass":
+        return logH
+    return np.concatenate([np.zeros((len(f0), 1)), logH], axis=1)
+
+def passband_gain(f0, Q, topology = "lowpass"):
+    '''The gain of a cascade of unit gain stages in its passband.  A
+    band-pass cascade's centre is the geometric mean of its stages'
+    f0.'''
+    if topology != "bandpass":
+        return 1.0
+    centre = np.exp(np.mean(np.log(f0)))
+    return float(np.exp(stage_log_magnitudes([centre], f0, Q, topology).sum()))
+
+def prefix_peaks(logH, order):
+    '''ln peak gain after each stage of an order'''
+    return np.cumsum(logH[order], axis=0).max(axis=1)
+
+def gain_floor(topology, H0):
+    '''The least cumulative gain wanted at any stage'''
+    return 0.0 if topology == "bandpass" else min(1.0, H0)
+
+def least_gains(H0, limits, floor):
+    '''The least cumulative gain after each stage, given their gain limits
+    in order, that leaves the stages after it able to reach H0.  Raises
+    ValueError if H0 is out of reach.'''
+    limits = np.asarray(limits, dtype=float)
+    if np.prod(limits) < H0:
+        raise ValueError("The stages can only reach a gain of %.4g, short of %.4g: %s" % (
+            np.prod(limits), H0, ", ".join("stage #%d up to %.4g" % (i + 1, limit)
+                                           for i, limit in enumerate(limits))))
+    after = np.concatenate([np.cumprod(limits[::-1])[::-1][1:], [1.0]])
+    return np.maximum(floor, H0 / after)
+
+def worst_peak(peaks, least):
+    '''ln of the highest node peak with the least gain at every node'''
+    return np.max(np.log(least) + peaks)
+
+def exhaustive_order(logH):
+    '''The order minimizing the highest internal peak, over every subset
+    of stages'''
+    n = len(logH)
+    sets = np.arange(1 << n)
+    members = (sets[:, None] >> np.arange(n)) & 1
+    peaks = (members @ logH).max(axis=1)  # Each subset's peak
+    sizes = members.sum(axis=1)
+
+    # best[s]: lowest possible highest peak on the way to having stages s
+    best = np.full(len(sets), np.inf)
+    best[0] = -np.inf
+    for size in range(1, n + 1):
+        layer = sets[sizes == size]
+        before = np.where(members[layer] == 1, best[layer[:, None] ^ (1 << np.arange(n))],
+                          np.inf)
+        best[layer] = np.maximum(peaks[layer], before.min(axis=1))
+
+    # The output node is the same for every order, so it doesn't count
+    order = [ ]
+    s = len(sets) - 1
+    while s:
+        last = min((i for i in range(n) if s >> i & 1), key=lambda i: best[s ^ (1 << i)])
+        order.append(last)
+        s ^= 1 << last
+    return order[::-1]
+
+def greedy_order(logH):
+    '''Adds whichever stage keeps the running peak lowest'''
+    remaining = list(range(len(logH)))
+    total = np.zeros(logH.shape[1])
+    order = [ ]
+    while remaining:
+        peaks = (total + logH[remaining]).max(axis=1)
+        k = int(np.argmin(peaks))
+        order.append(remaining.pop(k))
+        total += logH[order[-1]]
+    return order
+
+def cumulative_gains(H0, least, limits, target, hi):
+    '''Per-stage gains for cumulative gains as close to target as the
+    stage limits allow, and no more than hi unless least needs it'''
+    G = np.empty(len(least))
+    previous = 1.0
+    for k in range(len(G)):
+        G[k] = max(least[k], min(target[k], hi, previous * limits[k]))
+        previous = G[k]
+    G[-1] = H0
+    return np.concatenate([[G[0]], G[1:] / G[:-1]])
+
+def split_gains(peaks, H0, least, limits):
+    '''Per-stage gains, for ln prefix peaks of the chosen order'''
+    T = worst_peak(peaks, least)
+    target = np.exp(np.minimum.accumulate((T - peaks)[::-1])[::-1])
+    return cumulative_gains(H0, least, limits, target, max(1.0, H0))
+
+def early_gains(H0, limits, topology = "lowpass"):
+    '''Per-stage gains with H0 as early in the cascade as the stage limits
+    allow, which is all of it in the first stage unless a limit is hit'''
+    limits = np.asarray(limits, dtype=float)
+    least = least_gains(H0, limits, gain_floor(topology, H0))
+    return cumulative_gains(H0, least, limits, np.full(len(limits), H0), H0)
+
+def arrange(f0, Q, H0, npoints = NPOINTS, topology = "lowpass", limits = None):
+    '''Orders the stages of a cascade for headroom and splits H0, the
+    product of the stage gains, between them, each within its gain limit
+    if given.  Stages are given in the default order, which is kept unless
+    another is better.  Returns (order, gains, peaks): indexes into the
+    stages in their new order, each stage's gain in that order, and the
+    peak gain from the filter input to each stage's output.  Raises
+    ValueError if the limits can't reach H0.'''
+    logH = log_magnitudes(f0, Q, npoints, topology)
+    n = len(logH)
+    limits = np.full(n, np.inf) if limits is None else np.asarray(limits, dtype=float)
+    floor = gain_floor(topology, H0)
+
+    def worst(order):
+        return worst_peak(prefix_peaks(logH, order), least_gains(H0, limits[order], floor))
+
+    default = list(range(n))
+    order = exhaustive_order(logH) if n <= EXHAUSTIVE else greedy_order(logH)
+    if worst(order) >= worst(default) - MARGIN:
+        order = default
+
+    peaks = prefix_peaks(logH, order)
+    gains = split_gains(peaks, H0, least_gains(H0, limits[order], floor), limits[order])
+    return order, gains, np.exp(peaks + np.log(np.cumprod(gains)))
@@ -0,0 +1,36 @@
+# Bill of materials export
+
+import csv
+import re
+
+
+def refkey(ref):
+    '''Sort key placing R2 before R10'''
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', ref)]
+
+def kind(ref):
+    '''The letter prefix of a reference, e.g. "R" for R12'''
+    return re.match(r'[^\d]*', ref).group(0)
+
+def bom_rows(index):
+    '''Groups identical values in a PartsIndex.  Returns a sorted list of
+    (kind, value, quantity, [refs]) tuples.'''
+    groups = { }
+    for value, refs in index.values.items():
+        for ref in refs:
+            groups.setdefault((kind(ref), value), [ ]).append(ref)
+
+    rows = [ ]
+    for (k, value), refs in groups.items():
+        refs.sort(key=refkey)
+        rows.append((k, value, len(refs), refs))
+
+    rows.sort(key=lambda row: (row[0], refkey(row[3][0])))
+    return rows
+
+def write_bom_csv(file, index):
+    '''Writes a BOM with one line per distinct value to an open file'''
+    writer = csv.writer(file)
+    writer.writerow(["References", "Value", "Quantity"])
+    for k, value, qty, refs in bom_rows(index):
+        writer.writerow([" ".join(refs), value, qty])
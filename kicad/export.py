@@ -0,0 +1,243 @@
+# Single pass export of a schematic tree to any number of output formats
+
+import json
+
+from kicad.schema import *
+from kicad.bom import bom_rows, write_bom_csv, refkey
+
+
+def export(schema, sinks):
+    '''Walks the schematic tree once, handing every leaf item to each sink'''
+    for sink in sinks:
+        sink.Begin(schema)
+
+    for item in schema.Walk():
+        for sink in sinks:
+            sink.Record(item)
+
+    for sink in sinks:
+        sink.End()
+
+
+class Sink(object):
+    '''An export format.  Records arrive with their sheet origins set, so
+    item.SheetPosition() and item.Relocate() give sheet coordinates.'''
+
+    NAME = None
+
+    def __init__(self, file):
+        self.file = file
+
+    def Begin(self, schema):
+        self.schema = schema
+
+    def Record(self, item):
+        pass
+
+    def End(self):
+        pass
+
+
+class SchematicSink(Sink):
+    '''Legacy EESchema .sch output'''
+
+    NAME = "schematic"
+
+    def Begin(self, schema):
+        super(SchematicSink, self).Begin(schema)
+        self.file.write(schema.Header())
+
+    def Record(self, item):
+        self.file.write(item.ToString())
+
+    def End(self):
+        self.file.write(self.schema.Footer())
+
+
+class BOMSink(Sink):
+    '''Bill of materials CSV, taken from the schematic's parts index'''
+
+    NAME = "BOM"
+
+    def End(self):
+        write_bom_csv(self.file, self.schema.GetPartsIndex())
+
+
+class JSONSink(Sink):
+    '''A JSON summary: item counts, sheet extent, parts and BOM'''
+
+    NAME = "JSON summary"
+
+    def Begin(self, schema):
+        super(JSONSink, self).Begin(schema)
+        self.counts = { }
+        self.bounds = None
+
+    def Record(self, item):
+        kind = type(item).__name__
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+        x, y = item.SheetPosition()
+        if self.bounds is None:
+            self.bounds = [x, y, x, y]
+        else:
+            self.bounds = [min(self.bounds[0], x), min(self.bounds[1], y),
+                           max(self.bounds[2], x), max(self.bounds[3], y)]
+
+    def End(self):
+        index = self.schema.GetPartsIndex()
+        summary = { 'sheet': self.schema.size_name,
+                    'items': self.counts,
+                    'bounds': self.bounds,
+                    'parts': index.parts,
+                    'bom': [ { 'value': value, 'quantity': qty, 'refs': refs }
+                             for kind, value, qty, refs in bom_rows(index) ] }
+        json.dump(summary, self.file, indent=2, sort_keys=True)
+        self.file.write("\n")
+
+
+def spice_value(value):
+    '''Converts a schematic value to SPICE, where M means milli'''
+    if value[-1:] == "F":
+        value = value[0:-1]
+    if value[-1:] == "M":
+        value = value[0:-1] + "Meg"
+    return value
+
+
+class Connectivity(object):
+    '''Nets of a flat schematic as KiCad sees them: wires join at their
+    end points, a wire end or junction dot on another wire joins it, and
+    pins only connect to what ends or sits exactly on them.  Power symbols
+    and labels name their nets; GND becomes node 0.  Feed it sheet
+    positioned items with Add(), then call Resolve().'''
+
+    def __init__(self):
+        self.parent     = { }
+        self.names      = { }
+        self.components = [ ]  # (component, [(pin name, sheet position)])
+        self.wires      = [ ]
+        self.junctions  = [ ]
+        self.nodes      = None
+
+    def find(self, p):
+        parent = self.parent.setdefault(p, p)
+        while parent != p:
+            grand = self.parent[parent]
+            self.parent[p] = grand
+            p, parent = parent, grand
+        return p
+
+    def union(self, p1, p2):
+        r1 = self.find(p1)
+        r2 = self.find(p2)
+        if r1 != r2:
+            self.parent[r1] = r2
+
+    def Add(self, item):
+        if isinstance(item, Wire):
+            if item.kind == 'Wire':
+                start = item.SheetPosition()
+                end   = item.Relocate(item.end)
+                self.union(start, end)
+                self.wires.append((start, end))
+        elif isinstance(item, Connection):
+            pos = item.SheetPosition()
+            self.find(pos)
+            self.junctions.append(pos)
+        elif isinstance(item, (GlobalLabel, Label)):
+            self.names[item.SheetPosition()] = item.text
+        elif isinstance(item, Power):
+            self.names[item.SheetPosition()] = item.GetValue()
+        elif isinstance(item, Component):
+            pins = [(name, item.Relocate(pos)) for name, pos in item.Pins()]
+            if len(pins) > 0:
+                self.components.append((item, pins))
+                for name, pos in pins:
+                    self.find(pos)
+
+    def joinTees(self):
+        '''Joins wire ends and junctions that land on the middle of a wire'''
+        horizontal = { }
+        vertical   = { }
+        for start, end in self.wires:
+            if start[1] == end[1]:
+                horizontal.setdefault(start[1], [ ]).append((min(start[0], end[0]),
+                                                             max(start[0], end[0]), start))
+            elif start[0] == end[0]:
+                vertical.setdefault(start[0], [ ]).append((min(start[1], end[1]),
+                                                           max(start[1], end[1]), start))
+
+        points = set(self.junctions)
+        for start, end in self.wires:
+            points.add(start)
+            points.add(end)
+
+        for x, y in points:
+            for lo, hi, start in horizontal.get(y, [ ]):
+                if lo < x < hi:
+                    self.union((x, y), start)
+            for lo, hi, start in vertical.get(x, [ ]):
+                if lo < y < hi:
+                    self.union((x, y), start)
+
+    def nodeNames(self):
+        nodes = { }
+        for pos, name in self.names.items():
+            if name == "GND":
+                name = "0"
+            nodes[self.find(pos)] = name
+
+        unnamed = 1
+        for item, pins in self.components:
+            for name, pos in pins:
+                root = self.find(pos)
+                if not root in nodes:
+                    nodes[root] = "N%03d" % unnamed
+                    unnamed += 1
+        return nodes
+
+    def Resolve(self):
+        '''Joins tees and names every net.  Call once all items are added.'''
+        self.joinTees()
+        self.nodes = self.nodeNames()
+
+    def Node(self, pos):
+        '''Returns the net name at a sheet position'''
+        return self.nodes[self.find(pos)]
+
+    def PinNodes(self, pins):
+        '''Returns { pin name: net name } for a component's pins'''
+        return dict((name, self.Node(pos)) for name, pos in pins)
+
+
+class NetlistSink(Sink):
+    '''A SPICE netlist, with connectivity as Connectivity sees it.
+    Hierarchical sheets aren't followed, so run it on the flat schematic.'''
+
+    NAME = "netlist"
+
+    def Begin(self, schema):
+        super(NetlistSink, self).Begin(schema)
+        self.nets = Connectivity()
+
+    def Record(self, item):
+        self.nets.Add(item)
+
+    def End(self):
+        self.nets.Resolve()
+
+        self.file.write("* SPICE netlist, generated by filtergen\n")
+        for item, pins in sorted(self.nets.components, key=lambda c: refkey(c[0].GetRef())):
+            ref   = item.GetRef()
+            conns = " ".join(self.nets.Node(pos) for name, pos in pins)
+
+            if isinstance(item, OpAmp):
+                model = item.fields.get(FIELD_SPICE_SIM_NAME, { }).get('value', item.GetValue())
+                self.file.write("X%s %s %s\n" % (ref, conns, model))
+            elif isinstance(item, VSource):
+                model = item.fields.get(FIELD_SPICE_MODEL, { }).get('value', item.GetValue())
+                self.file.write("%s %s %s\n" % (ref, conns, model))
+            else:
+                self.file.write("%s %s %s\n" % (ref, conns, spice_value(item.GetValue())))
+        self.file.write(".end\n")
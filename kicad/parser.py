@@ -0,0 +1,241 @@
+# Streaming reader for the legacy EESchema .sch format written by schema.py
+#
+# Records are read one at a time from any iterable of lines, so large
+# files are never held in memory as text.  Components, wires, junctions,
+# notes and labels become the same objects the generator builds, with
+# the subclass picked from the library symbol so that Pins() knows the
+# geometry.  Anything else (sheets, no-connects, bus entries, bitmaps,
+# symbols from other libraries' layouts) is kept verbatim, so writing a
+# parsed schematic back reproduces it apart from whitespace.
+
+import re
+
+from kicad.schema import *
+
+
+class ParseError(Exception):
+    def __init__(self, message, lineno):
+        super(ParseError, self).__init__("line %d: %s" % (lineno, message))
+        self.lineno = lineno
+
+
+# Library symbol prefixes and the classes that know their pin geometry.
+# The first match wins.
+SYMBOL_CLASSES = [ ("Device:R_Small",         Resistor),
+                   ("Device:C_Small",         Capacitor),
+                   ("Device:L_Small",         Inductor),
+                   ("Device:LED_Small",       LED),
+                   ("Device:D_Small",         Diode),
+                   ("Simulation_SPICE:OPAMP", OpAmp),
+                   ("Amplifier_Operational:", OpAmp),
+                   ("Simulation_SPICE:",      VSource),
+                   ("power:",                 Power) ]
+
+FIELD_RE = re.compile(r'F\s+(\d+)\s+"((?:[^"\\]|\\.)*)"\s+([HV])\s+(-?\d+)\s+(-?\d+)\s+(\d+)'
+                      r'\s+([01]{4})\s+(\S)\s+(\S+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*$')
+
+LABELS = { "GLabel": GlobalLabel, "HLabel": HierLabel }
+
+
+def symbol_class(lib):
+    for prefix, cls in SYMBOL_CLASSES:
+        if lib.startswith(prefix):
+            return cls
+    return Component
+
+
+class RawRecord(Relocatable):
+    '''A record the object model doesn't cover, written back unchanged'''
+
+    def __init__(self, lines):
+        super(RawRecord, self).__init__((0, 0))
+        self.text = "".join(line + "\n" for line in lines)
+
+    def ToString(self):
+        return self.text
+
+
+class LineReader(object):
+    '''Iterates over lines without their line endings, counting them'''
+
+    def __init__(self, lines):
+        self.lines  = iter(lines)
+        self.lineno = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self.lines).rstrip("\r\n")
+        self.lineno += 1
+        return line
+
+    def Next(self, what):
+        '''Returns the next line, which must exist'''
+        try:
+            return next(self)
+        except StopIteration:
+            raise self.Error("file ends inside %s" % what)
+
+    def Error(self, message):
+        return ParseError(message, self.lineno)
+
+
+class ParsedSchematic(Schematic):
+    '''A schematic read from a file.  The header is written back as read.'''
+
+    def __init__(self, header):
+        super(ParsedSchematic, self).__init__("A4")
+        self.header = header
+
+        for line in header.splitlines():
+            words = line.split()
+            if len(words) >= 4 and words[0] == "$Descr":
+                self.size_name = words[1]
+                self.size = (int(words[2]), int(words[3]))
+            elif len(words) == 3 and words[0] == "Sheet":
+                self.sheet = (int(words[1]), int(words[2]))
+
+    def Header(self):
+        return self.header
+
+
+def read_header(reader):
+    '''Reads up to and including $EndDescr'''
+    lines = [ ]
+    for line in reader:
+        lines.append(line)
+        if line.startswith("$EndDescr"):
+            return "".join(line + "\n" for line in lines)
+        if len(lines) == 1 and not line.startswith("EESchema Schematic File"):
+            raise reader.Error("not a legacy EESchema schematic")
+    raise reader.Error("file ends inside the header")
+
+def read_field(reader, line, pos):
+    m = FIELD_RE.match(line)
+    if m is None:
+        raise reader.Error("bad field: %s" % line)
+    n, value, rot, x, y, size, flags, align, style, name = m.groups()
+    return int(n), { 'value': value,
+                     'rot': rot,
+                     'pos': (int(x) - pos[0], int(y) - pos[1]),
+                     'flags': list(flags),
+                     'size': int(size),
+                     'align': align,
+                     'style': style,
+                     'name': name }
+
+def read_component(reader):
+    lib = ref = uid = pos = orientation = None
+    unit   = (1, 1)
+    fields = { }
+    extra  = [ ]
+    unit_line = False
+
+    while True:
+        line  = reader.Next("$Comp")
+        words = line.split()
+        if line.startswith("$EndComp"):
+            break
+        elif len(words) == 0:
+            continue
+        elif words[0] == "L" and len(words) == 3:
+            lib, ref = words[1], words[2]
+        elif words[0] == "U" and len(words) == 4:
+            unit = (int(words[1]), int(words[2]))
+            uid  = words[3]
+        elif words[0] == "P" and len(words) == 3:
+            pos = (int(words[1]), int(words[2]))
+        elif words[0] == "F":
+            if pos is None:
+                raise reader.Error("field before position")
+            n, field = read_field(reader, line, pos)
+            fields[n] = field
+        elif line[0] == "\t" and len(words) == 3 and not unit_line:
+            unit_line = True # Repeats unit and position
+        elif line[0] == "\t" and len(words) == 4:
+            orientation = [int(w) for w in words]
+        else:
+            extra.append(line)
+
+    if lib is None or pos is None or orientation is None:
+        raise reader.Error("incomplete component")
+    if not FIELD_REF in fields:
+        raise reader.Error("component %s has no reference field" % ref)
+
+    item = symbol_class(lib).Restore(ref, lib, pos, orientation, uid, unit, fields)
+    item.extra = extra
+    return item
+
+def read_text(reader, line):
+    '''Text Notes, GLabel, HLabel and Label records: a header line and the
+    text.  Only the styles schema.py writes become objects.'''
+    text  = reader.Next("Text")
+    words = line.split()
+    raw   = RawRecord([line, text])
+    if len(words) < 7:
+        return raw
+
+    kind = words[1]
+    pos  = (int(words[2]), int(words[3]))
+    orient, size = int(words[4]), words[5]
+    if size != "50" or words[-2:] != ["~", "0"]:
+        return raw
+
+    if kind == "Notes" and orient == 0 and len(words) == 8:
+        return Text(pos, text)
+    elif kind == "Label" and len(words) == 8:
+        return Label(pos, text, orient)
+    elif kind in LABELS and len(words) == 9:
+        return LABELS[kind](pos, text, words[6], orient)
+    return raw
+
+def read_block(reader, line):
+    '''A $Name ... $EndName block, kept verbatim'''
+    end = "$End" + line.split()[0][1:]
+    lines = [line]
+    while not lines[-1].startswith(end):
+        lines.append(reader.Next(line))
+    return RawRecord(lines)
+
+def records(reader):
+    '''Yields the items of a schematic body, up to $EndSCHEMATC'''
+    for line in reader:
+        words = line.split()
+        if len(words) == 0:
+            continue
+        elif words[0] == "$EndSCHEMATC":
+            return
+        elif words[0] == "$Comp":
+            yield read_component(reader)
+        elif words[0] == "Wire" and len(words) == 3 and words[2] == "Line":
+            coords = reader.Next("Wire").split()
+            if len(coords) != 4:
+                raise reader.Error("bad wire coordinates")
+            x1, y1, x2, y2 = [int(c) for c in coords]
+            yield Wire((x1, y1), (x2, y2), words[1])
+        elif words[0] == "Entry":
+            yield RawRecord([line, reader.Next("Entry")])
+        elif words[0] == "Connection" and len(words) == 4:
+            yield Connection((int(words[2]), int(words[3])))
+        elif words[0] == "Text":
+            yield read_text(reader, line)
+        elif words[0].startswith("$"):
+            yield read_block(reader, line)
+        else:
+            yield RawRecord([line])
+
+    raise reader.Error("missing $EndSCHEMATC")
+
+def parse(lines):
+    '''Reads a schematic from an iterable of lines, such as an open file.
+    Returns a ParsedSchematic.'''
+    reader = LineReader(lines)
+    schema = ParsedSchematic(read_header(reader))
+    for item in records(reader):
+        schema.Add(item)
+    return schema
+
+def load(filename):
+    with open(filename, "r") as file:
+        return parse(file)
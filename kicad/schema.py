@@ -1,5 +1,8 @@
 import time
 
+# Identifies the output format; caches key on this
+SERIALIZER = "eeschema-legacy-4"
+
 def flip(pos):
     return (pos[1], pos[0])
 
@@ -61,6 +64,100 @@ class Relocatable(object):
     def PartsList(self):
         return None
 
+    def GetPartsIndex(self):
+        '''Returns the PartsIndex maintained by a container, or None for leaves'''
+        return None
+
+    def Walk(self):
+        '''Yields the leaf items below this one with their origins set for
+        output, in output order.  Leaves yield themselves.'''
+        yield self
+
+    def Pins(self):
+        '''Returns a list of (pin name, position) for electrical connection points'''
+        return [ ]
+
+    def Children(self):
+        '''Returns the items directly contained in this one'''
+        return [ ]
+
+
+class PartsIndex(object):
+    '''Parts of a (sub)circuit by reference and by value, kept up to date
+    as items are added rather than rebuilt on every lookup.  Entries
+    propagate to the indexes of enclosing circuits, and components report
+    later value or reference changes.'''
+
+    def __init__(self):
+        self.parts      = { }  # ref -> value
+        self.values     = { }  # value -> { ref: None } (an ordered set)
+        self.duplicates = [ ]  # (ref, old value, new value)
+        self.parents    = [ ]
+
+    def Include(self, item):
+        '''Indexes an item added to the circuit'''
+        index = item.GetPartsIndex()
+        if index is not None:
+            index.parents.append(self)
+            self.Merge(index.parts)
+            return
+
+        parts = item.PartsList()
+        if not parts is None:
+            self.Merge(parts)
+            if isinstance(item, Component):
+                item.indexes.append(self)
+
+    def Merge(self, parts):
+        for ref, value in parts.items():
+            self.Add(ref, value)
+
+    def Add(self, ref, value):
+        if ref in self.parts:
+            self.duplicates.append((ref, self.parts[ref], value))
+            self.dropValue(ref)
+
+        self.parts[ref] = value
+        self.values.setdefault(value, { })[ref] = None
+
+        for parent in self.parents:
+            parent.Add(ref, value)
+
+    def Remove(self, ref):
+        if not ref in self.parts:
+            return
+
+        self.dropValue(ref)
+        del self.parts[ref]
+
+        for parent in self.parents:
+            parent.Remove(ref)
+
+    def Replace(self, old, new):
+        '''Replaces a component's old PartsList() entries with its new ones'''
+        for ref in old.keys():
+            self.Remove(ref)
+        self.Merge(new)
+
+    def dropValue(self, ref):
+        refs = self.values[self.parts[ref]]
+        del refs[ref]
+        if len(refs) == 0:
+            del self.values[self.parts[ref]]
+
+    def Lookup(self, ref):
+        '''Returns the value of a reference, or None'''
+        return self.parts.get(ref)
+
+    def ByValue(self, value):
+        '''Returns the list of references with a given value'''
+        return list(self.values.get(value, { }).keys())
+
+    def Duplicates(self):
+        '''Returns a list of (ref, old value, new value) for references
+        that were added more than once'''
+        return self.duplicates
+
 
 class Component(Relocatable):
     def __init__(self, ref, comp, pos, orientation):
@@ -71,8 +168,23 @@ class Component(Relocatable):
         self.reference   = ref
         self.component   = comp
         self.uid         = "%08X" % ((int)(time.time()+counter))
+        self.unit        = (1, 1)  # unit and body style
         self.fields      = { 0: self.newField(ref, (0, 0), orientation) }
         self.orientation = orientation
+        self.indexes     = [ ]
+        self.extra       = [ ]  # other records kept verbatim, e.g. AR lines
+
+    @classmethod
+    def Restore(cls, ref, comp, pos, orientation, uid, unit, fields):
+        '''Recreates a component read back from a file.  Subclass
+        constructors aren't run: they would lay out fresh fields and take
+        the next reference number.'''
+        item = cls.__new__(cls)
+        Component.__init__(item, ref, comp, pos, orientation)
+        item.uid    = uid
+        item.unit   = unit
+        item.fields = fields
+        return item
 
     def newField(self, value, pos, orient):
         if orient == VERTICAL or orient == VERTICAL_FLIP:
@@ -91,10 +203,13 @@ class Component(Relocatable):
     def ToString(self):
         pos = self.SheetPosition()
 
-        s = "$Comp\nL %s %s\nU 1 1 %s\nP %s\n" % (self.component,
-                                                     self.reference,
-                                                     self.uid,
-                                                     "%s %s" % pos)
+        s = "$Comp\nL %s %s\nU %s %s %s\nP %s\n" % (self.component,
+                                                      self.reference,
+                                                      self.unit[0], self.unit[1],
+                                                      self.uid,
+                                                      "%s %s" % pos)
+        for line in self.extra:
+            s += line + "\n"
 
         for n in range(0,4):
             if not n in self.fields:
@@ -114,22 +229,38 @@ class Component(Relocatable):
                 s += ' "' + f['name'] + '"'
             s += "\n"
 
-        s += "\t1   %s %s\n" % pos
+        s += "\t%s   %s %s\n" % (self.unit[0], pos[0], pos[1])
         s += "\t%s   %s   %s   %s\n$EndComp\n" % tuple(self.orientation)
         return s
 
     def SetValue(self, value, pos = None):
         '''Set component value.  If pos omitted, merely update the value string'''
+        old = self.indexedParts()
         if pos is None:
             self.fields[FIELD_VALUE]['value'] = value
         else:
             self.fields[FIELD_VALUE] = self.newField(value, pos, self.orientation)
+        self.reindex(old)
 
     def SetRef(self, ref):
+        old = self.indexedParts()
         if not FIELD_REF in self.fields:
             self.fields[FIELD_REF] = self.newField(ref, self.Position(), HORIZONTAL)
         else:
             self.fields[FIELD_REF]['value'] = ref
+        self.reindex(old)
+
+    def indexedParts(self):
+        if len(self.indexes) == 0:
+            return None
+        return self.PartsList() or { }
+
+    def reindex(self, old):
+        if old is None:
+            return
+        new = self.PartsList() or { }
+        for index in self.indexes:
+            index.Replace(old, new)
 
     def GetRef(self):
         return self.fields[FIELD_REF]['value']
@@ -188,6 +319,9 @@ class Passive(Component):
         return (posx + (self.orientation[1] * type(self).SIZE),
                 posy + (self.orientation[0] * type(self).SIZE))
 
+    def Pins(self):
+        return [ ("1", self.GetPin1Pos()), ("2", self.GetPin2Pos()) ]
+
     def PlaceRefValue(self, width):
         if self.orientation == HORIZONTAL:
             self.PlaceField(FIELD_REF, (-125 - width, 0))
@@ -293,14 +427,25 @@ class OpAmp(Component):
     def GetPwrM(self):
         return Anchor(self.Position((-100, 300)))
 
+    def Pins(self):
+        # In Sim.Pins order
+        return [ ("in+", self.GetInP().Position()),
+                 ("in-", self.GetPin1Pos()),
+                 ("vcc", self.GetPwrP().Position()),
+                 ("vee", self.GetPwrM().Position()),
+                 ("out", self.GetPin2Pos()) ]
+
     def PartsList(self):
-        return { self.ref: self.value }
+        return { self.GetRef(): self.GetValue() }
 
         
 class Power(Component):
     def __init__(self, node, pos, orientation):
         super(Power, self).__init__("#PWR?", "power:" + node, pos, orientation)
 
+    def Pins(self):
+        return [ ("1", self.Position()) ]
+
 class Ground(Power):
     def __init__(self, pos):
         super(Ground, self).__init__("GND", pos, VERTICAL)
@@ -350,6 +495,10 @@ class VSource(Component):
     def GetPin2Pos(self):
         return self.Position((0, -200))
 
+    def Pins(self):
+        # Pin 1 (+) is on top
+        return [ ("1", self.GetPin2Pos()), ("2", self.GetPin1Pos()) ]
+
 class Wire(Relocatable):
     def __init__(self, start, end, kind = 'Wire'):
         super(Wire, self).__init__(start)
@@ -393,6 +542,13 @@ class Box(Relocatable):
         self.box.SetOrigin(self.origin)
         return self.box.ToString()
 
+    def Walk(self):
+        self.box.SetOrigin(self.origin)
+        return self.box.Walk()
+
+    def Children(self):
+        return [ self.box ]
+
 class Connection(Relocatable):
     def __init__(self, pos):
         super(Connection, self).__init__(pos)
@@ -415,20 +571,77 @@ class GlobalLabel(Relocatable):
         self.shape = shape
         self.orient = orientation
 
+    def Pins(self):
+        return [ ("1", self.Position()) ]
+
     def ToString(self):
         pos = self.SheetPosition()
         return "Text GLabel %s %s %s 50 %s ~ 0\n%s\n" % (pos[0], pos[1],
                                                          self.orient,
                                                          self.shape, self.text)
 class Label(Relocatable):
-    def __init__(self, pos, text):
+    def __init__(self, pos, text, orientation = 0):
         super(Label, self).__init__(pos)
         self.text = text
-        self.shape = shape
+        self.orient = orientation
+
+    def Pins(self):
+        return [ ("1", self.Position()) ]
+
+    def ToString(self):
+        pos = self.SheetPosition()
+        return "Text Label %s %s %s 50 ~ 0\n%s\n" % (pos[0], pos[1], self.orient, self.text)
+
+class HierLabel(GlobalLabel):
+    '''A hierarchical label, connecting to a pin of the sheet's symbol in the parent'''
+
+    def ToString(self):
+        pos = self.SheetPosition()
+        return "Text HLabel %s %s %s 50 %s ~ 0\n%s\n" % (pos[0], pos[1],
+                                                         self.orient,
+                                                         self.shape, self.text)
+
+class Sheet(Relocatable):
+    '''A hierarchical sheet symbol.  Pins are added on the left or right
+    edge and named after the sheet's hierarchical labels.'''
+
+    def __init__(self, pos, size, name, filename):
+        super(Sheet, self).__init__(pos)
+
+        global counter
+        counter = counter + 1
+        self.size     = size
+        self.name     = name
+        self.filename = filename
+        self.uid      = "%08X" % ((int)(time.time()+counter))
+        self.pins     = [ ]
+
+    def AddPin(self, name, shape, side, offset):
+        '''Adds a pin.  shape is I, O, B (bidirectional) etc.; side L or R;
+        offset is the distance down from the top edge.'''
+        self.pins.append((name, shape, side, offset))
+
+    def PinPos(self, side, offset):
+        if side == 'L':
+            return self.Position((0, offset))
+        return self.Position((self.size[0], offset))
+
+    def Pins(self):
+        return [ (name, self.PinPos(side, offset)) for name, shape, side, offset in self.pins ]
+
+    def GetPin(self, name):
+        '''Returns the position of a named pin'''
+        return dict(self.Pins())[name]
 
     def ToString(self):
         pos = self.SheetPosition()
-        return "Text Label %s %s 0 50 ~ 0\n%s\n" % (pos[0], pos[1], self.text)
+        s = "$Sheet\nS %s %s %s %s\nU %s\n" % (pos[0], pos[1], self.size[0], self.size[1], self.uid)
+        s += "F0 \"%s\" 50\nF1 \"%s\" 50\n" % (self.name, self.filename)
+        for n, (name, shape, side, offset) in enumerate(self.pins):
+            pinpos = self.Relocate(self.PinPos(side, offset))
+            s += "F%d \"%s\" %s %s %s %s 50\n" % (n + 2, name, shape, side, pinpos[0], pinpos[1])
+        s += "$EndSheet\n"
+        return s
 
 class Text(Relocatable):
     def __init__(self, pos, text):
@@ -467,37 +680,51 @@ class Schematic(object):
             self.size = flip(self.size)
 
         self.items = [ ]
+        self.index = PartsIndex()
+        self.sheet = (1, 1)
 
     def GetSize(self):
         return self.size
 
+    def SetSheetNumber(self, number, count):
+        '''Sets this file's place in a hierarchy of count sheets'''
+        self.sheet = (number, count)
+
     def Add(self, *args):
         self.items.extend(args)
+        for item in args:
+            self.index.Include(item)
 
-    def ToString(self):
+    def Header(self):
         s = "EESchema Schematic File Version 4\nEELAYER 26 0\nEELAYER END\n$Descr %s" % \
                      self.size_name
         s += " %s %s\n" % self.size
-        s += "encoding utf-8\nSheet 1 1\nTitle \"\"\nDate \"\"\nRev \"\"\nComp \"\"\nComment1 \"\"\nComment2 \"\"\nComment3 \"\"\nComment4 \"\"\n$EndDescr\n"
+        s += "encoding utf-8\nSheet %s %s\n" % self.sheet
+        s += "Title \"\"\nDate \"\"\nRev \"\"\nComp \"\"\nComment1 \"\"\nComment2 \"\"\nComment3 \"\"\nComment4 \"\"\n$EndDescr\n"
+        return s
 
+    def Footer(self):
+        return "$EndSCHEMATC\n"
+
+    def Walk(self):
         for item in self.items:
-            s += item.ToString()
+            yield from item.Walk()
 
-        s += "$EndSCHEMATC\n"
+    def Children(self):
+        return self.items
 
-        return s
+    def ToString(self):
+        return self.Header() + "".join(item.ToString() for item in self.Walk()) + self.Footer()
 
     def PartsList(self):
-        parts = { }
-        for item in self.items:
-            itemparts = item.PartsList()
-            if not itemparts is None:
-                parts.update(itemparts)
-
-        if len(parts) == 0:
+        '''Returns a copy of the indexed parts, or None if there are none'''
+        if len(self.index.parts) == 0:
             return None
 
-        return parts
+        return dict(self.index.parts)
+
+    def GetPartsIndex(self):
+        return self.index
 
 
 class SubCircuit(Relocatable):
@@ -505,28 +732,31 @@ class SubCircuit(Relocatable):
         super(SubCircuit, self).__init__(pos)
 
         self.items = [ ]
+        self.index = PartsIndex()
 
     def Add(self, *args):
         self.items.extend(args)
+        for item in args:
+            self.index.Include(item)
 
-    def ToString(self):
+    def Walk(self):
         pos = self.SheetPosition()
-
-        s = ""
         for item in self.items:
             item.SetOrigin(pos)
-            s += item.ToString()
+            yield from item.Walk()
 
-        return s
+    def Children(self):
+        return self.items
 
-    def PartsList(self):
-        parts = { }
-        for item in self.items:
-            itemparts = item.PartsList()
-            if not itemparts is None:
-                parts.update(itemparts)
+    def ToString(self):
+        return "".join(item.ToString() for item in self.Walk())
 
-        if len(parts) == 0:
+    def PartsList(self):
+        '''Returns a copy of the indexed parts, or None if there are none'''
+        if len(self.index.parts) == 0:
             return None
 
-        return parts
+        return dict(self.index.parts)
+
+    def GetPartsIndex(self):
+        return self.index
@@ -0,0 +1,177 @@
+# Geometry clean-up pass over a built schematic tree
+#
+# Circuits are built from many short Wire.Connect() segments through
+# corner points, which leaves zero length wires, duplicates, collinear
+# runs split into pieces and junction dots where nothing branches.  This
+# pass removes those while keeping connectivity as KiCad sees it: wires
+# join at end points, a junction joins everything on it, and pins only
+# connect to wire ends or other pins sitting exactly on them.  Two
+# collinear wires are only merged where nothing else touches the point
+# that ends up in the middle of the merged wire.
+
+from kicad.schema import *
+
+
+def containers(node):
+    '''Yields node and everything below it that has its own item list'''
+    if hasattr(node, 'items'):
+        yield node
+    for child in node.Children():
+        yield from containers(child)
+
+def count(points, p, n = 1):
+    points[p] = points.get(p, 0) + n
+    if points[p] == 0:
+        del points[p]
+
+
+class Segment(object):
+    '''A wire in sheet coordinates, and where it lives in the tree'''
+
+    def __init__(self, wire, container):
+        self.wire      = wire
+        self.container = container
+        self.start     = wire.SheetPosition()
+        self.end       = wire.Relocate(wire.end)
+
+    def Length(self):
+        return abs(self.end[0] - self.start[0]) + abs(self.end[1] - self.start[1])
+
+    def Key(self):
+        return (min(self.start, self.end), max(self.start, self.end))
+
+    def Set(self, start, end):
+        '''Moves the wire to new sheet coordinates'''
+        origin = self.wire.GetOrigin()
+        self.start = start
+        self.end   = end
+        self.wire.pos = (start[0] - origin[0], start[1] - origin[1])
+        self.wire.end = (end[0] - origin[0], end[1] - origin[1])
+
+
+class Simplifier(object):
+    def __init__(self, schema):
+        self.schema = schema
+
+        # Set every item's origin for sheet coordinates
+        self.pins      = { }
+        self.junctions = { }
+        for item in schema.Walk():
+            if isinstance(item, Connection):
+                self.junctions[item.SheetPosition()] = item
+            elif not isinstance(item, Wire):
+                for name, pos in item.Pins():
+                    count(self.pins, item.Relocate(pos))
+
+        self.segments = [ ]
+        for container in containers(schema):
+            for item in container.items:
+                if isinstance(item, Wire) and item.kind == 'Wire':
+                    self.segments.append(Segment(item, container))
+
+        self.removed = set()
+
+    def remove(self, item):
+        self.removed.add(id(item))
+
+    def dropDegenerate(self):
+        '''Drops zero length and duplicate wires'''
+        seen = set()
+        kept = [ ]
+        for seg in self.segments:
+            key = seg.Key()
+            if seg.Length() == 0 or key in seen:
+                self.remove(seg.wire)
+            else:
+                seen.add(key)
+                kept.append(seg)
+        self.segments = kept
+
+    def countEnds(self):
+        self.ends = { }
+        for seg in self.segments:
+            count(self.ends, seg.start)
+            count(self.ends, seg.end)
+
+    def passesThrough(self, p):
+        '''Number of wires with p strictly inside them'''
+        n = 0
+        for seg in self.segments:
+            (x1, y1), (x2, y2) = seg.start, seg.end
+            if x1 == x2 == p[0] and min(y1, y2) < p[1] < max(y1, y2):
+                n += 1
+            elif y1 == y2 == p[1] and min(x1, x2) < p[0] < max(x1, x2):
+                n += 1
+        return n
+
+    def dropJunctions(self):
+        '''Drops junction dots where fewer than three things meet'''
+        for p, junction in list(self.junctions.items()):
+            if self.ends.get(p, 0) + self.pins.get(p, 0) + 2 * self.passesThrough(p) < 3:
+                self.remove(junction)
+                del self.junctions[p]
+
+    def free(self, p, n):
+        '''True if nothing but the n wire ends being merged touches p'''
+        return self.pins.get(p, 0) == 0 and not p in self.junctions and self.ends.get(p, 0) == n
+
+    def mergeLine(self, segs, axis):
+        '''Merges collinear segments along one horizontal (axis 0) or
+        vertical (axis 1) line'''
+        def lo(seg):
+            return min(seg.start[axis], seg.end[axis])
+        def hi(seg):
+            return max(seg.start[axis], seg.end[axis])
+
+        segs.sort(key=lo)
+        current = segs[0]
+        for seg in segs[1:]:
+            if lo(seg) <= hi(current):
+                points = [current.start, current.end, seg.start, seg.end]
+                first = min(points)
+                last  = max(points)
+                inner = [p for p in points if p != first and p != last]
+                if all(self.free(p, inner.count(p)) for p in inner):
+                    for p in points:
+                        count(self.ends, p, -1)
+                    current.Set(first, last)
+                    count(self.ends, first)
+                    count(self.ends, last)
+                    self.remove(seg.wire)
+                    seg.wire = None
+                    continue
+            current = seg
+
+    def mergeCollinear(self):
+        horizontal = { }
+        vertical   = { }
+        for seg in self.segments:
+            if seg.start[1] == seg.end[1]:
+                horizontal.setdefault(seg.start[1], [ ]).append(seg)
+            elif seg.start[0] == seg.end[0]:
+                vertical.setdefault(seg.start[0], [ ]).append(seg)
+
+        for segs in horizontal.values():
+            self.mergeLine(segs, 0)
+        for segs in vertical.values():
+            self.mergeLine(segs, 1)
+
+        self.segments = [seg for seg in self.segments if seg.wire is not None]
+
+    def Run(self):
+        self.dropDegenerate()
+        self.countEnds()
+        self.dropJunctions()
+        self.mergeCollinear()
+
+        for container in containers(self.schema):
+            container.items[:] = [item for item in container.items
+                                  if not id(item) in self.removed]
+
+        return len(self.removed)
+
+
+def simplify(schema):
+    '''Simplifies the wiring of a schematic in place and returns the number
+    of records removed'''
+    return Simplifier(schema).Run()
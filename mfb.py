@@ -0,0 +1,157 @@
+# Vectorized multiple-feedback (Rauch) stage equations
+#
+# All three topologies share one layout: an input part to node A, a part
+# from A back to the output, a part from A to ground, one from A to the
+# inverting input and one from the inverting input to the output.
+#
+# Low-pass component names follow the reference stage in
+# doc/refstage.png: R3 is the input resistor, R1 the DC feedback
+# resistor, R2 feeds the inverting input, C1 goes to ground and C2 is the
+# feedback capacitor.  The transfer function is
+#
+#   H(s) = -(R1/R3) / (s^2 C1 C2 R1 R2 + s C2 (R1 + R2 + R1 R2/R3) + 1)
+#
+# The high-pass stage swaps resistors and capacitors: C1 is the input
+# capacitor, C2 the one back to the output, R1 goes to ground, C3 feeds
+# the inverting input and R2 is the feedback resistor.
+#
+#   H(s) = -(C1/C2) s^2 / (s^2 + s (C1 + C2 + C3) / (R2 C2 C3) + 1 / (R1 R2 C2 C3))
+#
+# The band-pass stage has input resistor R1, R2 to ground, C1 back to the
+# output, C2 to the inverting input and feedback resistor R3.
+#
+#   H(s) = -s / (R1 C1) / (s^2 + s (C1 + C2) / (R3 C1 C2) + (1/R1 + 1/R2) / (R3 C1 C2))
+#
+# Its H0 is the gain at f0, the centre frequency.  Both sizings make the
+# two capacitors equal.  All functions take NumPy arrays (or scalars) and
+# broadcast.
+
+import numpy as np
+
+
+def lowpass_design(f0, H0, Q, R1):
+    '''Returns component values (R1, R2, R3, C1, C2) for a stage with
+    corner frequency f0, DC gain magnitude H0 and quality factor Q'''
+    f0, H0, Q, R1 = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (f0, H0, Q, R1)])
+
+    R3 = R1 / H0
+    R2 = R1 / (1.0 + H0)
+    w0 = 2.0 * np.pi * f0
+    C1C2  = 1.0 / (w0**2 * R1 * R2)
+    rC1C2 = Q**2 * (np.sqrt(R2/R1) * (1.0 + H0) + np.sqrt(R1/R2))**2
+    C1 = np.sqrt(C1C2 * rC1C2)
+    C2 = C1C2 / C1
+
+    return R1, R2, R3, C1, C2
+
+def lowpass_response(R1, R2, R3, C1, C2):
+    '''Returns the (f0, Q, H0) realized by a set of component values'''
+    R1, R2, R3, C1, C2 = [np.asarray(v, dtype=float) for v in (R1, R2, R3, C1, C2)]
+
+    RC = np.sqrt(R1 * R2 * C1 * C2)
+    f0 = 1.0 / (2.0 * np.pi * RC)
+    Q  = RC / (C2 * (R1 + R2 + R1 * R2 / R3))
+    H0 = R1 / R3
+
+    return f0, Q, H0
+
+def highpass_design(f0, H0, Q, R1):
+    '''Returns component values (R1, R2, C1, C2, C3) for a high-pass stage
+    with corner frequency f0, high frequency gain magnitude H0 and quality
+    factor Q'''
+    f0, H0, Q, R1 = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (f0, H0, Q, R1)])
+
+    w0 = 2.0 * np.pi * f0
+    C  = 1.0 / (w0 * R1 * Q * (2.0 + H0))
+    R2 = Q**2 * (2.0 + H0)**2 * R1
+
+    return R1, R2, H0 * C, C, C
+
+def highpass_response(R1, R2, C1, C2, C3):
+    '''Returns the (f0, Q, H0) realized by a set of high-pass values'''
+    R1, R2, C1, C2, C3 = [np.asarray(v, dtype=float) for v in (R1, R2, C1, C2, C3)]
+
+    RC = np.sqrt(R1 * R2 * C2 * C3)
+    f0 = 1.0 / (2.0 * np.pi * RC)
+    Q  = RC / (R1 * (C1 + C2 + C3))
+    H0 = C1 / C2
+
+    return f0, Q, H0
+
+def bandpass_design(f0, H0, Q, R1):
+    '''Returns component values (R1, R2, R3, C1, C2) for a band-pass stage
+    with centre frequency f0, gain magnitude H0 there and quality factor
+    Q.  H0 must be under 2 Q^2.'''
+    f0, H0, Q, R1 = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (f0, H0, Q, R1)])
+    over = H0 >= 2.0 * Q**2
+    if np.any(over):
+        i = np.argmax(over.ravel())
+        raise ValueError("Band-pass stage gain %.4g is over its limit 2Q^2 = %.4g" % (
+            H0.ravel()[i], 2.0 * Q.ravel()[i]**2))
+
+    w0 = 2.0 * np.pi * f0
+    C  = Q / (H0 * w0 * R1)
+    R2 = H0 * R1 / (2.0 * Q**2 - H0)
+    R3 = 2.0 * H0 * R1
+
+    return R1, R2, R3, C, C
+
+def bandpass_response(R1, R2, R3, C1, C2):
+    '''Returns the (f0, Q, H0) realized by a set of band-pass values'''
+    R1, R2, R3, C1, C2 = [np.asarray(v, dtype=float) for v in (R1, R2, R3, C1, C2)]
+
+    RC = np.sqrt(R3 * C1 * C2 / (1.0 / R1 + 1.0 / R2))
+    f0 = 1.0 / (2.0 * np.pi * RC)
+    Q  = R3 * C1 * C2 / (RC * (C1 + C2))
+    H0 = R3 * C2 / (R1 * (C1 + C2))
+
+    return f0, Q, H0
+
+
+# Band-pass stages are sized for at most this much of their 2Q^2 gain
+# limit, where R2 would be infinite
+BANDPASS_GAIN_MARGIN = 0.99
+
+def gain_limit(topology, Q):
+    '''The highest gain stages of a topology are sized for, given their Q'''
+    Q = np.asarray(Q, dtype=float)
+    if topology == "bandpass":
+        return BANDPASS_GAIN_MARGIN * 2.0 * Q**2
+    return np.full(Q.shape, np.inf)
+
+
+# Topology: (component names, design function, response function)
+TOPOLOGIES = { "lowpass":  (("R1", "R2", "R3", "C1", "C2"), lowpass_design, lowpass_response),
+               "highpass": (("R1", "R2", "C1", "C2", "C3"), highpass_design, highpass_response),
+               "bandpass": (("R1", "R2", "R3", "C1", "C2"), bandpass_design, bandpass_response) }
+
+
+def components(topology):
+    '''The component names of a topology, in the order values come in'''
+    if not topology in TOPOLOGIES:
+        raise ValueError("Unknown topology %s; known ones are %s" % (
+            topology, " ".join(sorted(TOPOLOGIES.keys()))))
+    return TOPOLOGIES[topology][0]
+
+def design(topology, f0, H0, Q, R1):
+    '''Component values for any mix of stages, shaped (5, ...) with each
+    stage's values in its topology's component order.  topology is one
+    name for all stages, or broadcasts against the targets.'''
+    f0, H0, Q, R1 = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (f0, H0, Q, R1)])
+    if isinstance(topology, str):
+        components(topology)
+        return np.array(TOPOLOGIES[topology][1](f0, H0, Q, R1))
+
+    topology, f0, H0, Q, R1 = np.broadcast_arrays(np.asarray(topology), f0, H0, Q, R1)
+    values = np.empty((5,) + f0.shape)
+    for name in np.unique(topology):
+        components(name)
+        which = topology == name
+        values[:, which] = TOPOLOGIES[name][1](f0[which], H0[which], Q[which], R1[which])
+    return values
+
+def response(topology, values):
+    '''Returns the (f0, Q, H0) realized by values shaped (5, ...) in the
+    topology's component order'''
+    components(topology)
+    return TOPOLOGIES[topology][2](*values)
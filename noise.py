@@ -0,0 +1,111 @@
+# Output noise of MFB low-pass stages and cascades
+#
+# With the node between R1, R2, R3 and C1 called A and the inverting
+# input N, nodal analysis of a stage with an ideal op amp gives
+#
+#   Vout D = en (S (G2 + Y2) - G2^2) - S In - G2 Ia
+#   D = S Y2 + G1 G2,  S = G1 + G2 + G3 + Y1
+#
+# where G are resistor conductances, Y the capacitor admittances, In is
+# the current injected into N and Ia the current injected into A.  Each
+# resistor's thermal noise is a current source across it, so R1 and R3
+# inject into A, R2 into N and out of A, and the op amp current noise
+# into N.  Stage output noise is then shaped by all following stages.
+#
+# Everything is vectorized: component arrays shaped (..., stages) and a
+# frequency vector give spectra shaped (..., frequencies).
+
+import numpy as np
+
+import mfb
+
+BOLTZMANN = 1.380649e-23
+TEMPERATURE = 298.15
+NPOINTS = 400
+
+# np.trapz was renamed in NumPy 2
+trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+
+def stage_terms(f, R1, R2, R3, C1, C2):
+    '''Returns (S, D, G1, G2, G3, Y2) for broadcastable component arrays
+    and frequencies'''
+    s  = 2j * np.pi * f
+    G1, G2, G3 = 1.0 / R1, 1.0 / R2, 1.0 / R3
+    S = G1 + G2 + G3 + s * C1
+    D = S * s * C2 + G1 * G2
+    return S, D, G1, G2, G3, s * C2
+
+def stage_gain(f, R1, R2, R3, C1, C2):
+    '''Complex signal gain of a stage'''
+    S, D, G1, G2, G3, Y2 = stage_terms(f, R1, R2, R3, C1, C2)
+    return -G2 * G3 / D
+
+def stage_noise(f, R1, R2, R3, C1, C2, opamp, T = TEMPERATURE):
+    '''Output noise spectral density (V^2/Hz) of a single stage'''
+    S, D, G1, G2, G3, Y2 = stage_terms(f, R1, R2, R3, C1, C2)
+    fourkT = 4.0 * BOLTZMANN * T
+    D2 = np.abs(D)**2
+
+    # R1 and R3 into A, R2 between A and N
+    resistors = fourkT * ((G1 + G3) * G2**2 + G2 * np.abs(S - G2)**2) / D2
+    voltage   = opamp.en**2 * np.abs(S * (G2 + Y2) - G2**2)**2 / D2
+    current   = opamp.inoise**2 * np.abs(S)**2 / D2
+
+    return resistors + voltage + current
+
+
+class NoiseResult(object):
+    '''Noise spectra of a cascade.  stage_psd holds each stage's
+    contribution referred to the cascade output, shaped (..., stages,
+    frequencies); psd is their sum.  Integrated figures are RMS volts
+    over the frequency grid.'''
+
+    def __init__(self, f, stage_psd):
+        self.f         = f
+        self.stage_psd = stage_psd
+        self.psd       = stage_psd.sum(axis=-2)
+
+        self.stage_rms = np.sqrt(trapezoid(stage_psd, f, axis=-1))
+        self.rms       = np.sqrt(trapezoid(self.psd, f, axis=-1))
+
+
+def frequencies(fmin, fmax, npoints = NPOINTS):
+    return np.logspace(np.log10(fmin), np.log10(fmax), npoints)
+
+def cascade_noise(f, values, opamp, T = TEMPERATURE):
+    '''Noise of cascades given values = (R1, R2, R3, C1, C2), each an array
+    shaped (..., stages).  Returns a NoiseResult.'''
+    values = [np.asarray(v, dtype=float)[..., None] for v in values]
+    nstages = values[0].shape[-2]
+
+    own  = stage_noise(f, *values, opamp, T)          # (..., stages, nf)
+    gain = np.abs(stage_gain(f, *values))**2
+
+    # Gain from each stage's output to the cascade output: the product of
+    # all following stages' gains
+    following = np.ones_like(gain)
+    for k in range(nstages - 2, -1, -1):
+        following[..., k, :] = following[..., k+1, :] * gain[..., k+1, :]
+
+    return NoiseResult(f, own * following)
+
+def circuit_values(circuit):
+    '''Component value arrays (R1, R2, R3, C1, C2) shaped (stages,) for a
+    Lowpass or Cascade'''
+    stages = getattr(circuit, "stages", [circuit])
+    return np.array([stage.values for stage in stages]).T
+
+def analyze(circuit, opamp, fmax, fmin = 1.0, npoints = NPOINTS):
+    '''Noise of a built design over fmin..fmax'''
+    return cascade_noise(frequencies(fmin, fmax, npoints), circuit_values(circuit), opamp)
+
+def sweep_r1(f0, H0, Q, r1, opamp, fmax, fmin = 1.0, npoints = NPOINTS):
+    '''Integrated output noise for every candidate R1.  f0, H0 and Q are
+    per-stage arrays, r1 a vector of candidates.  Returns (rms noise per
+    candidate, index of the quietest).'''
+    r1 = np.asarray(r1, dtype=float)[:, None]
+    values = mfb.lowpass_design(np.asarray(f0)[None, :], np.asarray(H0)[None, :],
+                                np.asarray(Q)[None, :], r1)
+    result = cascade_noise(frequencies(fmin, fmax, npoints), values, opamp)
+    return result.rms, int(np.argmin(result.rms))
@@ -0,0 +1,39 @@
+# Op amp models used by the analyses
+#
+# Figures are typical datasheet values: input voltage noise density en
+# (V/rtHz) and input current noise density inoise (A/rtHz), both in the
+# flat region above the 1/f corner, gain-bandwidth product gbw (Hz) and
+# DC open loop gain aol (V/V).  The ideal part has infinite gain and
+# bandwidth.
+
+INF = float("inf")
+
+class OpAmpModel(object):
+    def __init__(self, name, en, inoise, gbw = INF, aol = INF):
+        self.name   = name
+        self.en     = en
+        self.inoise = inoise
+        self.gbw    = gbw
+        self.aol    = aol
+
+
+OPAMPS = dict((model.name, model) for model in [
+    OpAmpModel("ideal",   0.0,     0.0),
+    OpAmpModel("LM358",   40e-9,   0.1e-12,  1e6,    1e5),
+    OpAmpModel("LM321",   40e-9,   0.1e-12,  1e6,    1e5),
+    OpAmpModel("TL072",   18e-9,   0.01e-12, 3e6,    2e5),
+    OpAmpModel("NE5532",  5e-9,    0.7e-12,  10e6,   1e5),
+    OpAmpModel("OPA2134", 8e-9,    3e-15,    8e6,    1e6),
+    OpAmpModel("OPA1612", 1.1e-9,  1.7e-12,  40e6,   3e6),
+    OpAmpModel("AD8066",  7e-9,    0.6e-15,  145e6,  4.5e5),
+])
+
+DEFAULT = "LM358"
+
+def lookup(name):
+    '''Returns the model for a part name; raises ValueError listing the
+    known ones if there's no such part'''
+    if not name in OPAMPS:
+        raise ValueError("Unknown op amp %s; known parts are: %s" % (
+            name, " ".join(sorted(OPAMPS.keys()))))
+    return OPAMPS[name]
@@ -0,0 +1,19 @@
+# Command line option parsing shared by the scripts
+#
+# Options are --name or --name=value and may appear anywhere among the
+# positional arguments.  A bare --name maps to "", so "name" in opts
+# tests for a flag and opts.get(name) for a value.
+
+
+def parse_options(argv):
+    '''Splits --name[=value] options from the positional arguments'''
+    opts = { }
+    args = [ ]
+    for arg in argv:
+        if arg.startswith("--"):
+            name, _, value = arg[2:].partition("=")
+            opts[name] = value
+        else:
+            args.append(arg)
+
+    return opts, args
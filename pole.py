@@ -1,19 +1,117 @@
-import mpmath as mp
+# Stage Q and f multipliers for cascades of second order sections
+#
+# N is the number of stages, so the filter order is 2N.  Stage k has
+# quality factor Q and corner frequency f times the filter's corner
+# frequency.  The *_grid functions evaluate whole grids of designs at
+# once: n (and ripple) broadcast against each other and the results are
+# shaped (..., max(n)), smallest Q first, padded with NaN past each
+# design's own N.  The plain functions return lists for a single design
+# and are the q_enumerators Cascade takes.
+
+import numpy as np
+
+
+def stage_index(n):
+    '''Returns n shaped (..., 1), stage numbers k = 1..max(n) and the mask
+    of stages that exist'''
+    n = np.asarray(n, dtype=int)[..., None]
+    k = np.arange(1, n.max() + 1)
+    return n, k, k <= n
+
+def ordered(Q, f, valid):
+    '''Sorts stages by increasing Q, NaN padding last'''
+    Q = np.where(valid, Q, np.nan)
+    f = np.where(valid, f, np.nan)
+    order = np.argsort(Q, axis=-1, kind='stable')
+    return np.take_along_axis(Q, order, -1), np.take_along_axis(f, order, -1)
+
+def butterworth_grid(n):
+    '''Poles on the unit circle at (2k - 1) pi / 4N from the real axis'''
+    n, k, valid = stage_index(n)
+    theta = (2 * k - 1) * np.pi / (4.0 * n)
+    Q = 0.5 / np.cos(theta)
+    return ordered(Q, np.ones_like(Q), valid)
+
+def chebyshev_grid(n, ripple):
+    '''Chebyshev type I with passband ripple in dB, 0 < ripple < 3.  The
+    corner is where the response is 3dB below the passband peak; the DC
+    gain is at the bottom of the ripple for even orders.'''
+    n, k, valid = stage_index(n)
+    ripple = np.asarray(ripple, dtype=float)[..., None]
+    order = 2.0 * n
+
+    eps = np.sqrt(10.0 ** (ripple / 10.0) - 1.0)
+    a = np.arcsinh(1.0 / eps) / order
+    theta = (2 * k - 1) * np.pi / (2.0 * order)   # from the imaginary axis
+    sigma = np.sinh(a) * np.sin(theta)
+    omega = np.cosh(a) * np.cos(theta)
+    w0 = np.hypot(sigma, omega)
+
+    # -3dB where eps T(w) = 1, relative to the ripple band edge
+    w3 = np.cosh(np.arccosh(1.0 / eps) / order)
+
+    return ordered(w0 / (2.0 * sigma), w0 / w3, valid)
+
+def linkwitz_riley_grid(n):
+    '''Linkwitz-Riley of order 2N, i.e. a Butterworth of order N squared.
+    Each Butterworth section appears twice, and for odd N its real pole
+    pairs up into a Q = 1/2 stage.  The response is -6dB at the corner.'''
+    n, k, valid = stage_index(n)
+    j = (k + 1) // 2
+    # Order N Butterworth pairs sit at (2j - 1 + N mod 2) pi / 2N from
+    # the real axis
+    with np.errstate(divide='ignore'):
+        Q = 0.5 / np.cos((2 * j - 1 + n % 2) * np.pi / (2.0 * n))
+    Q = np.where(j <= n // 2, Q, 0.5)
+    return ordered(Q, np.ones_like(Q), valid)
+
+def critically_damped_grid(n):
+    '''N identical Q = 1/2 stages, each tuned up so the cascade is -3dB at
+    the corner'''
+    n, k, valid = stage_index(n)
+    f = 1.0 / np.sqrt(2.0 ** (1.0 / (2.0 * n)) - 1.0)
+    Q = np.full(valid.shape, 0.5)
+    return ordered(Q, np.broadcast_to(f, valid.shape), valid)
+
+
+def single(grid, n, *args):
+    '''Runs a grid function for one design and returns lists'''
+    Q, f = grid(int(n), *args)
+    return Q.tolist(), f.tolist()
 
 def butterworth(n):
     '''Returns a list of Q,f multiplier values for a cascade of length N.'''
+    return single(butterworth_grid, n)
 
-    n = int(n)
-    step = mp.pi/(2.0*n)
-    start = step/2.0
+def chebyshev(n, ripple):
+    '''Returns a list of Q,f multiplier values for a cascade of length N
+    with ripple dB of passband ripple.'''
+    return single(chebyshev_grid, n, ripple)
+
+def linkwitz_riley(n):
+    '''Returns a list of Q,f multiplier values for a cascade of length N.'''
+    return single(linkwitz_riley_grid, n)
+
+def critically_damped(n):
+    '''Returns a list of Q,f multiplier values for a cascade of length N.'''
+    return single(critically_damped_grid, n)
+
+
+def bandpass(Q, f, bandwidth):
+    '''Maps low-pass Q,f multiplier lists onto a band-pass cascade of twice
+    the length, with bandwidth relative to the centre frequency.  Each
+    low-pass pole p becomes the roots of s^2 - bandwidth p s + 1, whose
+    product is 1, so the stages' f multipliers are centred on 1 on a log
+    scale.  Returns lists with the smallest Q first.'''
+    Q = np.asarray(Q, dtype=float)
+    f = np.asarray(f, dtype=float)
 
-    q = []
-    value = start
-    while value < mp.pi/2:
-        q.append(1./(2.0*mp.cos(value)))
-        value += step
+    p = f * (-0.5 / Q + 1j * np.sqrt(np.maximum(1.0 - 0.25 / Q**2, 0.0)))
+    d = np.sqrt((bandwidth * p)**2 - 4.0 + 0j)
+    s = np.concatenate([bandwidth * p + d, bandwidth * p - d]) / 2.0
 
-    return q, [1.0] * int(n)
+    Q, f = ordered(np.abs(s) / (-2.0 * s.real), np.abs(s), np.ones(len(s), dtype=bool))
+    return Q.tolist(), f.tolist()
 
 
 # Presolved bessel Q,f (a,b) polynomials
@@ -45,8 +143,7 @@ def bessel(n):
     n = int(n)
 
     if n > 8:
-        print("Max cascade length for Bessel filters is 8")
-        exit(1)
+        raise ValueError("Max cascade length for Bessel filters is 8")
 
     # Return with smallest Q in the first stage
     return BESSEL_Q[n-1][::-1], BESSEL_F[n-1][::-1]
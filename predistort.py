@@ -0,0 +1,93 @@
+# Finite gain-bandwidth op amp effects on MFB low-pass stages
+#
+# With the op amp gain A(s) = Aol / (1 + s Aol / wt), wt = 2 pi GBW, the
+# stage (names as in noise.py) becomes
+#
+#   H(s) = -G2 G3 / (D + E / A),  D = S Y2 + G1 G2,  E = S (G2 + Y2) - G2^2
+#
+# whose denominator is a cubic in s.  The dominant pole pair gives the
+# realized f0 and Q; the third pole sits near the GBW.  Predistortion
+# iterates on the design f0, Q and H0 until the realized values match the
+# targets, for all stages at once.
+
+import numpy as np
+
+import mfb
+
+TOLERANCE = 1e-9
+MAX_ITERATIONS = 100
+
+
+def denominator(R1, R2, R3, C1, C2, opamp):
+    '''Cubic denominator coefficients (c3, c2, c1, c0), each shaped like
+    the broadcast component arrays'''
+    R1, R2, R3, C1, C2 = [np.asarray(v, dtype=float) for v in (R1, R2, R3, C1, C2)]
+    G1, G2, G3 = 1.0 / R1, 1.0 / R2, 1.0 / R3
+    G = G1 + G2 + G3
+
+    d2, d1, d0 = C1 * C2, G * C2, G1 * G2
+    e2, e1, e0 = C1 * C2, G * C2 + C1 * G2, (G1 + G3) * G2
+
+    k = 1.0 / (2.0 * np.pi * opamp.gbw)  # 1/wt
+    a = 1.0 / opamp.aol
+    return k * e2, d2 + k * e1 + a * e2, d1 + k * e0 + a * e1, d0 + a * e0
+
+def cubic_roots(c3, c2, c1, c0):
+    '''Roots of batches of cubics, shaped (..., 3), as eigenvalues of
+    their companion matrices'''
+    c3, c2, c1, c0 = np.broadcast_arrays(c3, c2, c1, c0)
+    M = np.zeros(c3.shape + (3, 3))
+    M[..., 0, 0] = -c2 / c3
+    M[..., 0, 1] = -c1 / c3
+    M[..., 0, 2] = -c0 / c3
+    M[..., 1, 0] = 1.0
+    M[..., 2, 1] = 1.0
+    return np.linalg.eigvals(M)
+
+def response(R1, R2, R3, C1, C2, opamp):
+    '''Returns the (f0, Q, H0) realized by component values with a given
+    op amp model'''
+    c3, c2, c1, c0 = denominator(R1, R2, R3, C1, C2, opamp)
+    H0 = 1.0 / (np.asarray(R2, dtype=float) * np.asarray(R3, dtype=float) * c0)
+
+    if not np.isfinite(opamp.gbw):
+        w0 = np.sqrt(c0 / c2)
+        return w0 / (2.0 * np.pi), np.sqrt(c0 * c2) / c1, H0
+
+    # Work in units of the ideal w0 to keep the companion matrix well
+    # conditioned
+    wref = np.sqrt(c0 / c2)
+    x = cubic_roots(c3 * wref**3, c2 * wref**2, c1 * wref, c0)
+
+    # The dominant pair is the two slowest poles, complex or not
+    x = np.take_along_axis(x, np.argsort(np.abs(x), axis=-1), -1)
+    w0 = np.sqrt(np.real(x[..., 0] * x[..., 1])) * wref
+    Q  = np.sqrt(np.real(x[..., 0] * x[..., 1])) / -np.real(x[..., 0] + x[..., 1])
+    return w0 / (2.0 * np.pi), Q, H0
+
+def predistort(f0, Q, H0, R1, opamp, tol = TOLERANCE, max_iterations = MAX_ITERATIONS):
+    '''Finds the design (f0, Q, H0) for each stage whose values, built with
+    the given op amp, realize the target f0, Q and H0.  Arguments
+    broadcast.  Returns (f0, Q, H0, converged), converged being False for
+    stages the op amp is too slow for, which are left at their targets.'''
+    f0, Q, H0, R1 = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (f0, Q, H0, R1)])
+    design = [f0.copy(), Q.copy(), H0.copy()]
+    targets = [f0, Q, H0]
+
+    for i in range(max_iterations):
+        realized = response(*mfb.lowpass_design(design[0], design[2], design[1], R1), opamp)
+        ratios = [t / r for t, r in zip(targets, realized)]
+        error = np.max([np.abs(r - 1.0) for r in ratios], axis=0)
+
+        # Only the stages that aren't there yet move
+        moving = ~(error < tol)
+        if not moving.any():
+            break
+        for d, r in zip(design, ratios):
+            d[moving] = (d * r)[moving]
+
+    # Stages that can't be reached are left at their targets
+    converged = error < tol
+    for d, t in zip(design, targets):
+        d[~converged] = t[~converged]
+    return design[0], design[1], design[2], converged
@@ -0,0 +1,69 @@
+# Lightweight phase timing and counters for the generator's hot paths
+
+import sys
+import time
+
+enabled  = False
+phases   = { }  # name -> [seconds, calls], in first-seen order
+counters = { }
+
+
+class Phase(object):
+    '''Times a with block and adds it to the named phase'''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        entry = phases.setdefault(self.name, [0.0, 0])
+        entry[0] += elapsed
+        entry[1] += 1
+        return False
+
+
+class NullPhase(object):
+    '''Stands in for Phase when profiling is off'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_PHASE = NullPhase()
+
+
+def enable(on = True):
+    global enabled
+    enabled = on
+
+def phase(name):
+    '''Returns a context manager timing the named phase, a no-op when disabled'''
+    if not enabled:
+        return NULL_PHASE
+    return Phase(name)
+
+def count(name, n = 1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+def reset():
+    phases.clear()
+    counters.clear()
+
+def report(file = sys.stdout):
+    '''Prints the phase breakdown and counters.  Phases may nest, so times
+    are inclusive and don't necessarily add up to the total.'''
+    print("%-16s %8s %12s" % ("phase", "calls", "total ms"), file=file)
+    for name, (seconds, calls) in phases.items():
+        print("%-16s %8d %12.3f" % (name, calls, seconds * 1e3), file=file)
+
+    if len(counters) > 0:
+        print(file=file)
+        for name, value in counters.items():
+            print("%-16s %8d" % (name, value), file=file)
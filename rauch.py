@@ -1,60 +1,157 @@
-# Rauch/MFB low-pass filter calculator
+# Rauch/MFB filter calculator
 
 import mpmath as mp
 
 from siutils import SUFFIXES, si_val, sisuffix, nsigdig
 from kicad.schema import *
+import headroom
+import mfb
 import pole
+import predistort
+import profiling
 
 NQDIGITS=6
 NHDIGITS=4
 
-class Lowpass(Relocatable):
-    '''Single low pass filter stage'''
-
-    def __init__(self, pos, f, H0, Q, R1, annot, box = False, sim = False):
-        super(Lowpass, self).__init__(pos)
+VERSION="0.5"
+
+
+class StageResult(object):
+    '''Design of one stage.  values are the unrounded component values
+    and labels their schematic values, both in the order of the
+    topology's components (R1, R2, R3, C1, C2 for low-pass; see mfb.py).
+    design is the (f, H0, Q) they were sized for when predistorted for
+    opamp (a part name), else None; converged is False if that op amp
+    can't reach the targets.'''
+
+    def __init__(self, f0, H0, Q, values, labels, design = None, opamp = None,
+                 converged = True, topology = "lowpass"):
+        self.f0        = f0
+        self.H0        = H0
+        self.Q         = Q
+        self.values    = values
+        self.labels    = labels
+        self.design    = design
+        self.opamp     = opamp
+        self.converged = converged
+        self.topology  = topology
+
+    def AsDict(self):
+        return dict(self.__dict__)
+
+
+class DesignResult(object):
+    '''A whole filter: its kind, f0, H0 and a StageResult per stage in
+    signal order.  peaks are the peak gains from the filter input to each
+    stage's output, if the stages were arranged for headroom.'''
+
+    def __init__(self, kind, f0, H0, stages, peaks = None):
+        self.kind   = kind
+        self.f0     = f0
+        self.H0     = H0
+        self.stages = stages
+        self.peaks  = peaks
+
+    def AsDict(self):
+        return { 'kind': self.kind, 'f0': self.f0, 'H0': self.H0,
+                 'stages': [stage.AsDict() for stage in self.stages],
+                 'peaks': self.peaks }
+
+
+# Where the parts of a stage go, by their place in the network (see
+# Stage.Network): position and orientation
+PLACES = { "input":     ((750,1000), HORIZONTAL),
+           "feedback":  ((1100,650), VERTICAL),
+           "ground":    ((1100,1300), VERTICAL),
+           "inverting": ((1400,1000), HORIZONTAL),
+           "across":    ((1700,650), VERTICAL) }
+
+
+class Stage(Relocatable):
+    '''A single MFB filter stage.  Subclasses name their topology, a key
+    into mfb.TOPOLOGIES, and give its LAYOUT: (component, place) in the
+    order the parts are numbered.  With an op amp model,
+    values are sized for the design (f, H0, Q) that op amp turns into the
+    targets; a Cascade passes the design, and the values, it already
+    worked out for all stages.'''
+
+    TOPOLOGY = None
+    NAME     = None
+    ABBREV   = None
+    LAYOUT   = None
+
+    def __init__(self, pos, f, H0, Q, R1, annot, box = False, sim = False, opamp = None,
+                 design = None, values = None):
+        super(Stage, self).__init__(pos)
 
         self.annot = annot
         self.box   = box
         self.sim   = sim
+        self.opamp = opamp
 
-        # Calculate component values
-        R3 = R1 / H0
-        R2 = R1/(1.0 + H0)
-        w0 = 2.0 * f * mp.pi
-        # The product C1*C2
-        C1C2 = 1/(mp.power(w0, 2.0)*R1*R2)
-        # The ratio C1/C2
-        rC1C2 = mp.power(Q, 2.0)*mp.power(mp.sqrt(R2/R1)*(1+H0)+mp.sqrt(R1/R2), 2.0)
-        # C1, C2
-        C1 = mp.sqrt(C1C2*rC1C2)
-        C2 = C1C2/C1
-
-        self.R1 = "%s" % sisuffix(R1)
-        self.R2 = "%s" % sisuffix(R2)
-        self.R3 = "%s" % sisuffix(R3)
-        self.C1 = "%sF" % sisuffix(C1)
-        self.C2 = "%sF" % sisuffix(C2)
+        # Design targets
+        self.f0 = float(f)
+        self.H0 = float(H0)
+        self.Q  = float(Q)
         self.f  = "%sHz" % sisuffix(f)
 
+        self.converged = True
+        if opamp is not None and design is None:
+            if self.TOPOLOGY != "lowpass":
+                raise ValueError("Predistortion is only worked out for low-pass stages")
+            with profiling.phase("predistort"):
+                fd, Qd, Hd, converged = predistort.predistort(f, Q, H0, R1, opamp)
+            design = (float(fd), float(Hd), float(Qd))
+            self.converged = bool(converged)
+
+        # Stages the op amp is too slow for come back at their targets
+        if design == (self.f0, self.H0, self.Q):
+            design = None
+        self.design = design
+        if design is not None:
+            f, H0, Q = design
+
+        with profiling.phase("design"):
+            if values is None:
+                values = mfb.design(self.TOPOLOGY, f, H0, Q, R1)
+
+            # Unrounded values for analysis, in the topology's component order
+            self.values = tuple(float(v) for v in values)
+            self.labels = tuple("%s" % sisuffix(v) if name[0] == "R" else "%sF" % sisuffix(v)
+                                for name, v in zip(mfb.components(self.TOPOLOGY), self.values))
+            for name, label in zip(mfb.components(self.TOPOLOGY), self.labels):
+                setattr(self, name, label)
+
         if self.sim:
             self.OPAMP = "${SIM.PARAMS}"
         else:
             self.OPAMP = "LM358" # Just a dummy value
 
-        self.Build()
+        with profiling.phase("build"):
+            self.Build()
+        profiling.count("stages")
+
+    def Result(self):
+        return StageResult(self.f0, self.H0, self.Q, self.values, self.labels, self.design,
+                           self.opamp.name if self.opamp is not None else None,
+                           self.converged, self.TOPOLOGY)
 
-    def Print(self, ident):
-        print("Rauch LPF Stage (%s)" % ident)
-        print("  R1: %sohm" % self.R1)
-        print("  R2: %sohm" % self.R2)
-        print("  R3: %sohm" % self.R3)
-        print("  C1: %s" % self.C1)
-        print("  C2: %s" % self.C2)
-        
     def Build(self):
         '''Build a filter stage subcircuit.'''
+        parts = { }
+        for name, place in self.LAYOUT:
+            pos, orientation = PLACES[place]
+            part = Resistor if name[0] == "R" else Capacitor
+            parts[place] = part(getattr(self, name), pos, orientation)
+
+        self.Network(**parts)
+
+    def Network(self, input, feedback, ground, inverting, across):
+        '''Builds the stage subcircuit around its passive network: input to
+        node A, feedback from A to the output, ground from A to ground,
+        inverting from A to the op amp's inverting input and across from
+        there to the output.  The op amp, its supplies and the output go
+        around it the same way for every topology.'''
         stage = SubCircuit((0,0))
         
         if self.annot != "":
@@ -63,40 +160,34 @@ class Lowpass(Relocatable):
         if self.box:
             stage.Add(Box((300, 50), (3400, 1800)))
 
-        r1 = Resistor(self.R1, (1100,650), VERTICAL)
-        r2 = Resistor(self.R2, (1400,1000), HORIZONTAL)
-        r3 = Resistor(self.R3, (750,1000), HORIZONTAL)
         conn1 = Connection((1100, 1000))
 
-        stage.Add(r1, r2, r3, conn1,
-                  Wire.Connect(r1, conn1),
-                  Wire.Connect(r3, conn1),
-                  Wire.Connect(conn1, r2))
-
-        c1 = Capacitor(self.C1, (1100,1300), VERTICAL)
-        c2 = Capacitor(self.C2, (1700,650), VERTICAL)
+        stage.Add(feedback, inverting, input, conn1,
+                  Wire.Connect(feedback, conn1),
+                  Wire.Connect(input, conn1),
+                  Wire.Connect(conn1, inverting))
 
         gnd1 = Ground((1100,1500))
-        stage.Add(c1, c2, gnd1,
-                  Wire.Connect(conn1, c1), 
-                  Wire.Connect(c1, gnd1))
+        stage.Add(ground, across, gnd1,
+                  Wire.Connect(conn1, ground), 
+                  Wire.Connect(ground, gnd1))
 
         conn2 = Connection((1700,1000))
         stage.Add(conn2,
-                  Wire.Connect(r2, conn2), 
-                  Wire.Connect(c2, conn2))
+                  Wire.Connect(inverting, conn2), 
+                  Wire.Connect(across, conn2))
 
         conn3 = Connection((1700,300))
         stage.Add(conn3,
-                  Wire.Connect(conn3, c2))
+                  Wire.Connect(conn3, across))
 
         corner1 = Corner((1100,300))
         stage.Add(corner1,
                   Wire.Connect(conn3, corner1),
-                  Wire.Connect(corner1, r1),
-                  Wire.Connect(conn3, c2))
+                  Wire.Connect(corner1, feedback),
+                  Wire.Connect(conn3, across))
 
-        opamp = OpAmp(self.OPAMP, (2450, 1000), VERTICAL, sim)
+        opamp = OpAmp(self.OPAMP, (2450, 1000), VERTICAL, self.sim)
 
         corner2 = Connection((3050, 1000))
         corner3 = Corner((3050, 300))
@@ -128,7 +219,7 @@ class Lowpass(Relocatable):
 
         self.circuit = stage
         self.output  = corner4
-        self.input   = r3
+        self.input   = input
 
     def GetPin1Pos(self):
         return self.input.GetPin1Pos()
@@ -146,60 +237,178 @@ class Lowpass(Relocatable):
         self.circuit.SetOrigin(self.SheetPosition())
         return self.circuit.ToString()
 
+    def Walk(self):
+        self.circuit.SetOrigin(self.SheetPosition())
+        return self.circuit.Walk()
+
+    def Children(self):
+        return [ self.circuit ]
+
     def PartsList(self):
         return self.circuit.PartsList()
 
+    def GetPartsIndex(self):
+        return self.circuit.GetPartsIndex()
+
+    @staticmethod
+    def Prototype(Qlist, flist, bandwidth):
+        '''Stage Q and f multipliers from a low-pass q_enumerator's.
+        bandwidth is relative to the corner frequency, for band-pass.'''
+        return Qlist, flist
+
+
+class Lowpass(Stage):
+    '''Single low pass filter stage'''
+
+    TOPOLOGY = "lowpass"
+    NAME     = "Low-Pass"
+    ABBREV   = "LPF"
+    LAYOUT   = [("R1", "feedback"), ("R2", "inverting"), ("R3", "input"),
+                ("C1", "ground"), ("C2", "across")]
+
+
+class Highpass(Stage):
+    '''Single high pass filter stage; H0 is the gain well above f'''
+
+    TOPOLOGY = "highpass"
+    NAME     = "High-Pass"
+    ABBREV   = "HPF"
+    LAYOUT   = [("R1", "ground"), ("R2", "across"), ("C1", "input"),
+                ("C2", "feedback"), ("C3", "inverting")]
+
+    @staticmethod
+    def Prototype(Qlist, flist, bandwidth):
+        # Mirroring the response about the corner inverts each f
+        return Qlist, [1.0 / m for m in flist]
+
+
+class Bandpass(Stage):
+    '''Single band pass filter stage; f is the centre frequency and H0 the
+    gain there'''
+
+    TOPOLOGY = "bandpass"
+    NAME     = "Band-Pass"
+    ABBREV   = "BPF"
+    LAYOUT   = [("R1", "input"), ("R2", "ground"), ("R3", "across"),
+                ("C1", "feedback"), ("C2", "inverting")]
+
+    @staticmethod
+    def Prototype(Qlist, flist, bandwidth):
+        if bandwidth is None:
+            raise ValueError("A band-pass cascade needs a bandwidth")
+        return pole.bandpass(Qlist, flist, bandwidth)
+
+
+# Stage classes by topology
+STAGES = { stage.TOPOLOGY: stage for stage in [Lowpass, Highpass, Bandpass] }
+
 
 class Cascade(Relocatable):
-    def __init__(self, pos, f, H0, n, R1, q_enumerator, kind, sim):
+    '''A chain of stages of stage_type, Lowpass by default.  f is the
+    corner or, for band-pass, the centre frequency, and bandwidth is in
+    Hz.  By default the stages are ordered and H0 split between them for
+    the most headroom (see headroom.py); otherwise they go lowest Q first
+    with all the gain in the first.'''
+
+    def __init__(self, pos, f, H0, n, R1, q_enumerator, kind, sim, opamp = None,
+                 arrange = True, stage_type = Lowpass, bandwidth = None):
         super(Cascade, self).__init__(pos)
 
-        self.input = None
+        self.kind   = kind
+        self.f0     = float(f)
+        self.H0     = float(H0)
+        self.input  = None
         self.output = None
+        self.stages = [ ]
 
         self.circuit = SubCircuit((0,0))
 
-        self.circuit.Add(Text((300, 2100), "%s Multiple-Feedback Low-Pass Filter\\nGain=%s, f=%sHz" % (
-            kind, H0, sisuffix(f))))
+        title = "%s Multiple-Feedback %s Filter\\nGain=%s, f=%sHz" % (
+            kind, stage_type.NAME, H0, sisuffix(f))
+        if bandwidth is not None:
+            title += ", BW=%sHz" % sisuffix(bandwidth)
+        self.circuit.Add(Text((300, 2100), title))
+
+        if opamp is not None and stage_type.TOPOLOGY != "lowpass":
+            raise ValueError("Predistortion is only worked out for low-pass stages")
+
+        with profiling.phase("poles"):
+            Qlist, flist  = q_enumerator(n)
+            flist = flist[:len(Qlist)]
+            Qlist, flist = stage_type.Prototype(Qlist, flist, bandwidth / f
+                                                if bandwidth is not None else None)
+
+        # What the stage gains multiply to
+        H = H0 / headroom.passband_gain([f * m for m in flist], Qlist, stage_type.TOPOLOGY)
+
+        # Band-pass stages can only take so much gain each
+        limits = mfb.gain_limit(stage_type.TOPOLOGY, Qlist)
+
+        self.peaks = None
+        if arrange:
+            with profiling.phase("headroom"):
+                order, gains, peaks = headroom.arrange([f * m for m in flist], Qlist, H,
+                                                       topology = stage_type.TOPOLOGY,
+                                                       limits = limits)
+            Qlist = [Qlist[k] for k in order]
+            flist = [flist[k] for k in order]
+            gains = gains.tolist()
+            self.peaks = peaks.tolist()
+        else:
+            gains = headroom.early_gains(H, limits, stage_type.TOPOLOGY).tolist()
+
+        # Predistort every stage at once
+        designs = [None] * len(Qlist)
+        converged = [True] * len(Qlist)
+        if opamp is not None:
+            with profiling.phase("predistort"):
+                fd, Qd, Hd, converged = predistort.predistort(
+                    [f * m for m in flist], Qlist, gains, R1, opamp)
+            designs = list(zip(fd.tolist(), Hd.tolist(), Qd.tolist()))
+
+        # Size every stage at once
+        sizing = [designs[i] if designs[i] is not None else (f * flist[i], gains[i], Qlist[i])
+                  for i in range(len(Qlist))]
+        with profiling.phase("design"):
+            values = mfb.design(stage_type.TOPOLOGY, *zip(*sizing), R1).T
 
-        Qlist, flist  = q_enumerator(n)
         prev   = None
         xpos   = 0
         outpos = (-150, 1000)
         inpos  = (650, 1000)
 
-        H = H0
-
         i = 1
         for Q in Qlist:
             f_stage = f * flist[i-1]
-            stage = Lowpass((xpos, 0), f_stage, H, Q, R1,
-                            "#%d: H=%s, Q=%s, f0=%s" % (
-                                i,
-                                nsigdig(H, NHDIGITS),
-                                nsigdig(Q, NQDIGITS),
-                                "%sHz" % sisuffix(f_stage)),
-                            True, sim)
+            H = gains[i-1]
+            stage = stage_type((xpos, 0), f_stage, H, Q, R1,
+                               "#%d: H=%s, Q=%s, f0=%s" % (
+                                   i,
+                                   nsigdig(H, NHDIGITS),
+                                   nsigdig(Q, NQDIGITS),
+                                   "%sHz" % sisuffix(f_stage)),
+                               True, sim, opamp, designs[i-1], values[i-1])
+            stage.converged = bool(converged[i-1])
             self.circuit.Add(stage)
+            self.stages.append(stage)
 
             if prev is None:
                 self.input = stage.GetInput()
             else:
                 self.circuit.Add(Wire(outpos, inpos))
-                print()
 
-            stage.Print("#%s, H=%s, Q=%s, f=%sHz" % (i, nsigdig(H, NHDIGITS),
-                                                     nsigdig(Q, NQDIGITS),
-                                                     sisuffix(f_stage)))
             prev   = stage
             xpos  += 3200
             outpos = addpos(outpos, (3200, 0))
             inpos  = addpos(inpos, (3200, 0))
 
             i += 1
-            H  = 1.0
 
         self.output  = prev.GetOutput()
+
+    def Result(self):
+        return DesignResult(self.kind, self.f0, self.H0,
+                            [stage.Result() for stage in self.stages], self.peaks)
         
     def GetPin1Pos(self):
         return self.input.GetPin1Pos()
@@ -217,27 +426,86 @@ class Cascade(Relocatable):
         self.circuit.SetOrigin(self.SheetPosition())
         return self.circuit.ToString()
 
+    def Walk(self):
+        self.circuit.SetOrigin(self.SheetPosition())
+        return self.circuit.Walk()
+
+    def Children(self):
+        return [ self.circuit ]
+
     def PartsList(self):
         return self.circuit.PartsList()
 
+    def GetPartsIndex(self):
+        return self.circuit.GetPartsIndex()
+
 
 class ButterworthCascade(Cascade):
     '''A lowpass filter cascasde with flat passpand frequency response.'''
 
-    def __init__(self, pos, f, H0, n, R1, sim):
+    def __init__(self, pos, f, H0, n, R1, sim, opamp = None, arrange = True,
+                 stage_type = Lowpass, bandwidth = None):
         super(ButterworthCascade, self).__init__(pos, f, H0, n, R1, pole.butterworth,
-                                                 "Butterworth", sim)
+                                                 "Butterworth", sim, opamp, arrange,
+                                                 stage_type, bandwidth)
 
 
 class BesselCascade(Cascade):
     '''A lowpass filter cascasde with flat passpand phase response.'''
 
-    def __init__(self, pos, f, H0, n, R1, sim):
-        super(BesselCascade, self).__init__(pos, f, H0, n, R1, pole.bessel, "Bessel", sim)
+    def __init__(self, pos, f, H0, n, R1, sim, opamp = None, arrange = True,
+                 stage_type = Lowpass, bandwidth = None):
+        super(BesselCascade, self).__init__(pos, f, H0, n, R1, pole.bessel, "Bessel", sim,
+                                            opamp, arrange, stage_type, bandwidth)
+
+
+class ChebyshevCascade(Cascade):
+    '''A lowpass filter cascade with equiripple passband and steeper roll-off.
+    ripple is the passband ripple in dB.'''
+
+    def __init__(self, pos, f, H0, n, R1, ripple, sim, opamp = None, arrange = True,
+                 stage_type = Lowpass, bandwidth = None):
+        super(ChebyshevCascade, self).__init__(pos, f, H0, n, R1,
+                                               lambda n: pole.chebyshev(n, ripple),
+                                               "Chebyshev %sdB" % nsigdig(ripple, 3), sim,
+                                               opamp, arrange, stage_type, bandwidth)
+
+
+class LinkwitzRileyCascade(Cascade):
+    '''A lowpass filter cascade for crossovers: -6dB at f, summing flat with
+    the matching high-pass.'''
+
+    def __init__(self, pos, f, H0, n, R1, sim, opamp = None, arrange = True,
+                 stage_type = Lowpass, bandwidth = None):
+        super(LinkwitzRileyCascade, self).__init__(pos, f, H0, n, R1, pole.linkwitz_riley,
+                                                   "Linkwitz-Riley", sim, opamp, arrange,
+                                                   stage_type, bandwidth)
+
+
+class CriticallyDampedCascade(Cascade):
+    '''A lowpass filter cascade with no overshoot at all.'''
+
+    def __init__(self, pos, f, H0, n, R1, sim, opamp = None, arrange = True,
+                 stage_type = Lowpass, bandwidth = None):
+        super(CriticallyDampedCascade, self).__init__(pos, f, H0, n, R1,
+                                                      pole.critically_damped,
+                                                      "Critically Damped", sim, opamp,
+                                                      arrange, stage_type, bandwidth)
 
         
 if __name__ == "__main__":
-    import sys, os, string
+    import sys, os, string, contextlib, json, logging
+    from cache import SchematicCache, DEFAULT_MAX_BYTES, parse_size
+    from catalog import Catalog, DEFAULT_PATH as CATALOG_PATH
+    from kicad.export import export, SchematicSink, NetlistSink, BOMSink, JSONSink
+    from kicad.simplify import simplify
+    from options import parse_options
+    import numpy as np
+    import transient
+    import noise
+    import opamps
+
+    log = logging.getLogger("rauch")
 
     def usage():
         progname = os.path.split(sys.argv[0])[-1]
@@ -246,10 +514,44 @@ if __name__ == "__main__":
         print("  %s [sim] stage f0 H0 Q R1 [filename]" % progname)
         print("  %s [sim] butterworth f0 H0 N R1 [filename]" % progname)
         print("  %s [sim] bessel f0 H0 N R1 [filename]" % progname)
+        print("  %s [sim] chebyshev f0 H0 N R1 ripple [filename]" % progname)
+        print("  %s [sim] linkwitz-riley f0 H0 N R1 [filename]" % progname)
+        print("  %s [sim] critical f0 H0 N R1 [filename]" % progname)
+        print()
+        print("options:")
+        print("  --cache=DIR       reuse schematics previously generated for the same spec")
+        print("  --cache-size=N    bound the cache directory to N bytes (default 64M); the")
+        print("                    k, M and G suffixes are binary here, so 64M is 64MiB")
+        print("  --cache-link      hard link cache hits instead of copying them")
+        print("  --bom=FILE        also write a bill of materials CSV to FILE")
+        print("  --netlist=FILE    also write a SPICE netlist to FILE")
+        print("  --json=FILE       also write a JSON summary to FILE")
+        print("  --profile[=FILE]  print a timing breakdown, and dump cProfile stats to FILE")
+        print("  --step[=RUNS]     print step response figures, with a RUNS Monte Carlo")
+        print("  --noise[=BW]      print output noise up to BW (default 10 f0), and the quietest R1")
+        print("  --opamp=PART      op amp for analyses (default %s)" % opamps.DEFAULT)
+        print("  --predistort[=PART]  size stages so that PART's finite gain-bandwidth")
+        print("                    gives the intended response (default: the --opamp part)")
+        print("  --catalog[=DB]    record designs in DB, and show the nearest vetted one")
+        print("  --use-vetted[=D]  with --catalog, build the nearest vetted design instead if")
+        print("                    it's within distance D of the spec (default %s)" %
+              DEFAULT_VETTED_DISTANCE)
+        print("  --from-catalog=ID build design ID from the catalog; give only [filename]")
+        print("  --no-simplify     keep redundant wire segments and junctions")
+        print("  --sheets          write a root sheet with one hierarchical sheet per stage")
+        print("  --no-arrange      put stages lowest Q first with all the gain in the first,")
+        print("                    instead of ordering them and splitting the gain for headroom")
+        print("  --highpass        make a high-pass filter instead")
+        print("  --bandpass[=BW]   make a band-pass filter centred on f0 instead; cascades")
+        print("                    are 2N stages, BW Hz wide at the corner response")
+        print("  --quiet           only print warnings and errors")
         print()
         print("     Generates either a single stage or an N-stage Rauch/MFB low-pass filter")
         print("     with a specific response.  Calculates component values for a cut-off")
-        print("     frequency (-3dB) of f0 Hz, gain H0.")
+        print("     frequency (-3dB) of f0 Hz, gain H0.  High-pass filters have gain H0")
+        print("     well above f0, band-pass ones at f0.")
+        print("     Chebyshev filters take the passband ripple in dB, under 3dB.")
+        print("     Linkwitz-Riley filters are -6dB at f0, for crossovers.")
         print("     R1 is used to scale resistors, with 1k being a good starting point.")
         print("     If supplied, a KiCad schmatic is output to 'filename'.")
         print()
@@ -280,6 +582,106 @@ if __name__ == "__main__":
             schema.Add(hookups);
 
 
+    def open_output(name, newline = None):
+        '''Opens an output file for writing as a new file, so that one hard
+        linked to a cache entry by --cache-link is replaced rather than
+        written through'''
+        if os.path.lexists(name):
+            os.remove(name)
+        return open(name, "w", newline=newline)
+
+
+    # Root sheet layout for --sheets, in mils
+    SHEET_SIZE   = (1500, 700)
+    SHEET_PITCH  = (2600, 1400)
+    SHEET_MARGIN = 1000
+    SHEET_STUB   = 300
+
+    def write_sheets(circuit, filename, sim, f0, simplify_wires):
+        '''Writes a root sheet at filename with one hierarchical sheet symbol
+        per stage.  Stages with identical values share a sheet file.
+        Returns the list of files written.'''
+        stages = getattr(circuit, "stages", [circuit])
+        base, ext = os.path.splitext(filename)
+
+        # Write the distinct stage sheets
+        subsheets = { }
+        names = [ ]
+        for i, stage in enumerate(stages):
+            values = stage.labels
+            if not values in subsheets:
+                subsheets[values] = (len(subsheets) + 2, "%s-stage%d%s" % (base, i + 1, ext),
+                                     stage)
+            names.append(subsheets[values][1])
+
+        written = [filename]
+        for number, name, stage in sorted(subsheets.values(), key=lambda s: s[0]):
+            sheet = Schematic("A4")
+            sheet.SetSheetNumber(number, len(subsheets) + 1)
+
+            pos = stage.Position()
+            stage.SetOrigin((SHEET_MARGIN - pos[0], SHEET_MARGIN - pos[1]))
+            inpin  = addpos(stage.GetPin1Pos(), stage.SheetPosition())
+            outpin = addpos(stage.GetPin2Pos(), stage.SheetPosition())
+            vin    = HierLabel(addpos(inpin, (-SHEET_STUB, 0)), "IN", "Input")
+            vout   = HierLabel(addpos(outpin, (SHEET_STUB, 0)), "OUT", "Output", 2)
+
+            sheet.Add(stage, vin, vout, Wire(vin.GetPin2Pos(), inpin),
+                      Wire(outpin, vout.GetPin1Pos()))
+            if simplify_wires:
+                simplify(sheet)
+
+            with open_output(name) as file:
+                file.write(sheet.ToString())
+            written.append(name)
+
+        # Pick the smallest page the sheet symbols fit on
+        for size in ["A4", "A3", "A2", "A1", "A0"]:
+            root = Schematic(size)
+            width, height = root.GetSize()
+            top = SHEET_MARGIN
+            left = SHEET_MARGIN
+            if sim:
+                left += 2000 # Leave room for the simulation sources
+            cols = max(1, (width - left - SHEET_MARGIN) // SHEET_PITCH[0])
+            rows = (len(stages) + cols - 1) // cols
+            if top + rows * SHEET_PITCH[1] <= height - SHEET_MARGIN:
+                break
+
+        root.SetSheetNumber(1, len(subsheets) + 1)
+        for i, name in enumerate(names):
+            x = left + (i % cols) * SHEET_PITCH[0]
+            y = top + (i // cols) * SHEET_PITCH[1]
+            symbol = Sheet((x, y), SHEET_SIZE, "Stage %d" % (i + 1), os.path.basename(name))
+            symbol.AddPin("IN", "I", "L", SHEET_SIZE[1] // 2)
+            symbol.AddPin("OUT", "O", "R", SHEET_SIZE[1] // 2)
+            root.Add(symbol)
+
+            # Stages connect through net labels, so rows can wrap
+            inpin   = symbol.GetPin("IN")
+            outpin  = symbol.GetPin("OUT")
+            instub  = addpos(inpin, (-SHEET_STUB, 0))
+            outstub = addpos(outpin, (SHEET_STUB, 0))
+            root.Add(Wire(instub, inpin), Wire(outpin, outstub))
+
+            if i == 0:
+                root.Add(GlobalLabel(instub, "VIN", "Input"))
+            else:
+                root.Add(Label(instub, "N%d" % i, 2))
+
+            if i == len(names) - 1:
+                root.Add(GlobalLabel(outstub, "VOUT", "Output", 2))
+            else:
+                root.Add(Label(outstub, "N%d" % (i + 1)))
+
+        if sim:
+            add_sim_stuffs(root, f0)
+
+        with open_output(filename) as file:
+            file.write(root.ToString())
+
+        return written
+
     def add_sim_stuffs(schema, f0):
         '''Adds simulation bits: VSS, VDD supplies, a source, a 100k load, etc.'''
 
@@ -385,13 +787,235 @@ if __name__ == "__main__":
 '''
         return result.replace("\n", "\\n")
 
-    def do_common(func, args, sim):
-        filename = None
-        if len(args) > 4:
-            filename = args[4]
+    def lookup_opamp(name):
+        try:
+            return opamps.lookup(name)
+        except ValueError as e:
+            log.error("%s", e)
+            exit(1)
+
+    # How far, over (log10 f0, H0, Q), --use-vetted reaches by default
+    DEFAULT_VETTED_DISTANCE = 0.01
+
+    def catalog_point(func, args):
+        '''(mode, stages, f0, H0, Q) of a design as the catalog indexes it,
+        from the mode's arguments alone.  Q is the highest stage Q.'''
+        mode   = func.__name__[3:]
+        f0, H0 = si_val(args[0]), si_val(args[1])
+        if mode == "stage":
+            return mode, 1, f0, H0, si_val(args[2])
+
+        n = int(si_val(args[2]))
+        enumerator = { "butterworth":    pole.butterworth,
+                       "bessel":         pole.bessel,
+                       "chebyshev":      lambda n: pole.chebyshev(n, si_val(args[4])),
+                       "linkwitz_riley": pole.linkwitz_riley,
+                       "critical":       pole.critically_damped }[mode]
+        return mode, n, f0, H0, max(enumerator(n)[0])
+
+    def catalog_lookup(catalog, func, args, predistort_for, arrange, within):
+        '''Offers the nearest vetted design in the catalog before designing.
+        Returns it if it's within distance within, to be built instead,
+        otherwise None.'''
+        mode, n, f0, H0, Q = catalog_point(func, args)
+        predistort_name = predistort_for.name if predistort_for is not None else None
+        spec = catalog.Spec(mode, [si_val(arg) for arg in args], predistort_name, arrange)
+
+        with profiling.phase("catalog"):
+            nearest = catalog.Nearest(mode, n, f0, H0, Q)
+        if nearest is None:
+            return None
+
+        distance, design = nearest
+        if design.spec == spec:
+            return None
+
+        log.info("Nearest vetted design in the catalog: %s (distance %s)",
+                 design.Describe(), nsigdig(distance, 3))
+        if within is not None and distance <= within:
+            log.info("Building it instead\n")
+            return design
+
+        log.info("Build it with --from-catalog=%d\n", design.id)
+        return None
+
+    def catalog_design(catalog, func, args, circuit, n, predistort_for, arrange):
+        '''Records a design in the catalog'''
+        mode   = func.__name__[3:]
+        stages = getattr(circuit, "stages", [circuit])
+        f0, H0 = si_val(args[0]), si_val(args[1])
+        Q      = max(stage.Q for stage in stages)
+        predistort_name = predistort_for.name if predistort_for is not None else None
+
+        with profiling.phase("catalog"):
+            id, new = catalog.Record(mode, [si_val(arg) for arg in args], predistort_name,
+                                     n, f0, H0, Q,
+                                     [(stage.f0, stage.Q, stage.H0, stage.labels)
+                                      for stage in stages], arrange)
+
+        values = [stage.labels for stage in stages]
+        if not new and [v for f, q, h, v in catalog.Stages(id)] != values:
+            log.warning("\nWarning: values differ from those recorded for design #%d", id)
+
+        if new:
+            log.info("\nRecorded as design #%d", id)
+        elif catalog.Get(id).vetted:
+            log.info("\nThis is vetted design #%d in the catalog", id)
+
+    def report_step(circuit, runs):
+        '''Logs step response figures, and their spread for component tolerances'''
+        r = transient.simulate(*transient.stage_params(circuit))
+        log.info("\nStep response: overshoot %s%%, rise time %ss, %d%% settling time %ss",
+                 nsigdig(r.overshoot[0], 3), sisuffix(r.rise_time[0]),
+                 transient.SETTLE_BAND * 100, sisuffix(r.settling_time[0]))
+
+        if runs > 0:
+            mc = transient.monte_carlo(circuit, runs)
+            log.info("Monte Carlo, %d runs (R 2%%, C 5%%):", runs)
+            for name, values, unit in [("overshoot", mc.overshoot, "%"),
+                                       ("rise time", mc.rise_time, "s"),
+                                       ("settling time", mc.settling_time, "s")]:
+                log.info("  %-14s mean %s%s, max %s%s", name, sisuffix(np.nanmean(values)), unit,
+                         sisuffix(np.nanmax(values)), unit)
+
+    # Candidate R1 values for the noise sweep: E12, 100ohm-82k
+    E12 = [1.0, 1.2, 1.5, 1.8, 2.2, 2.7, 3.3, 3.9, 4.7, 5.6, 6.8, 8.2]
+    R1_CANDIDATES = [v * 10**d for d in range(2, 5) for v in E12]
+
+    def report_noise(circuit, bandwidth, opamp, f0):
+        '''Logs integrated output noise per stage and in total, and the R1
+        giving the least noise.  bandwidth defaults to 10 times the
+        filter's f0.'''
+        stages = getattr(circuit, "stages", [circuit])
+        if bandwidth is None:
+            bandwidth = 10.0 * f0
+
+        r = noise.analyze(circuit, opamp, bandwidth)
+        log.info("\nOutput noise, %s, 1Hz-%sHz:", opamp.name, sisuffix(bandwidth))
+        for i, rms in enumerate(r.stage_rms):
+            log.info("  stage #%d  %sV rms", i + 1, sisuffix(rms))
+        log.info("  total     %sV rms", sisuffix(r.rms))
+
+        rms, best = noise.sweep_r1([stage.f0 for stage in stages],
+                                   [stage.H0 for stage in stages],
+                                   [stage.Q for stage in stages],
+                                   R1_CANDIDATES, opamp, bandwidth)
+        log.info("  quietest E12 R1: %sohm, %sV rms", sisuffix(R1_CANDIDATES[best]),
+                 sisuffix(rms[best]))
+
+    def stage_report(result, ident):
+        '''The component value listing of a StageResult, as lines'''
+        lines = ["Rauch %s Stage (%s)" % (STAGES[result.topology].ABBREV, ident)]
+        for name, label in zip(mfb.components(result.topology), result.labels):
+            lines.append("  %s: %s%s" % (name, label, "ohm" if name[0] == "R" else ""))
+        if result.design is not None:
+            f, H0, Q = result.design
+            lines.append("  (sized for f=%sHz, H=%s, Q=%s to allow for the %s)" % (
+                sisuffix(f), nsigdig(H0, NHDIGITS), nsigdig(Q, NQDIGITS), result.opamp))
+        return lines
+
+    def design_report(circuit):
+        '''Returns (warnings, listing) for a designed stage or cascade'''
+        peaks = None
+        if isinstance(circuit, Cascade):
+            result = circuit.Result()
+            stages = result.stages
+            peaks  = result.peaks
+            idents = ["#%s, H=%s, Q=%s, f=%sHz" % (i + 1, nsigdig(stage.H0, NHDIGITS),
+                                                   nsigdig(stage.Q, NQDIGITS),
+                                                   sisuffix(stage.f0))
+                      for i, stage in enumerate(stages)]
+            which = ["stage #%d" % (i + 1) for i in range(len(stages))]
+        else:
+            stages = [circuit.Result()]
+            idents = ["Q=%s" % nsigdig(stages[0].Q, NQDIGITS)]
+            which  = ["this stage"]
+
+        warnings = ["Warning: the %s is too slow for %s; sized as if ideal" % (stage.opamp, w)
+                    for stage, w in zip(stages, which) if not stage.converged]
+        listing = [ ]
+        for stage, ident in zip(stages, idents):
+            if len(listing) > 0:
+                listing.append("")
+            listing += stage_report(stage, ident)
+        if peaks is not None:
+            # To 0.01dB, so unity peaks don't come out as rounding noise;
+            # adding 0.0 turns -0.0 into 0
+            listing += ["", "Peak gain to each stage output: %s" % " ".join(
+                "%sdB" % nsigdig(round(20.0 * np.log10(peak), 2) + 0.0, 3) for peak in peaks)]
+        return warnings, listing
+
+    def do_common(func, args, filename, sim, cache = None, link = False, outputs = [ ],
+                  step = None, noise_bw = None, opamp = None, simplify_wires = True,
+                  sheets = False, predistort_for = None, catalog = None, arrange = True,
+                  stage_type = Lowpass, bandwidth = None, catalog_within = None):
+        '''args are the mode's numeric arguments.  outputs is a list of
+        (sink class, filename) for additional formats.  opamp is the model
+        for the noise analysis, predistort_for the one values are sized
+        for, if any.  Designs are recorded in catalog, if given, and a
+        vetted one within catalog_within of the spec is built instead.
+        Stages are stage_type, with a band-pass cascade bandwidth Hz wide.'''
+        if catalog is not None:
+            try:
+                vetted = catalog_lookup(catalog, func, args, predistort_for, arrange,
+                                        catalog_within)
+            except ValueError as e:
+                log.error("%s", e)
+                exit(1)
+            if vetted is not None:
+                func = MODES[vetted.spec['mode'].replace("_", "-")][0]
+                args = [repr(arg) for arg in vetted.spec['args']]
+                predistort_for = None
+                if vetted.spec['predistort']:
+                    predistort_for = lookup_opamp(vetted.spec['predistort'])
+                arrange = vetted.spec.get('arrange', True)
+
+        key = None
+        if cache is not None and filename is not None:
+            spec = [func.__name__, sim, simplify_wires] + [si_val(arg) for arg in args]
+            if predistort_for is not None:
+                spec.append(predistort_for.name)
+            if not arrange:
+                spec.append("no-arrange")
+            if stage_type is not Lowpass:
+                spec += [stage_type.TOPOLOGY, bandwidth]
+            key = cache.Key(spec)
+            # Only the schematic itself is cached, and a catalog has to see
+            # the designed stages to record them
+            report = None
+            if len(outputs) == 0 and step is None and opamp is None and not sheets and \
+               catalog is None:
+                with profiling.phase("cache"):
+                    report = cache.Fetch(key, filename, link)
+            if report is not None:
+                report = json.loads(report)
+                for line in report['warnings']:
+                    log.warning("%s", line)
+                log.info("%s", "\n".join(report['listing']))
+                log.info("\nWrote schematic to %s (cached)", filename)
+                return
+
+        try:
+            circuit, n, f0 = func(sim, args, predistort_for, arrange, stage_type, bandwidth)
+        except ValueError as e:
+            log.error("%s", e)
+            exit(1)
+
+        warnings, listing = design_report(circuit)
+        for line in warnings:
+            log.warning("%s", line)
+        log.info("%s", "\n".join(listing))
+        report = json.dumps({ 'warnings': warnings, 'listing': listing })
+
+        if catalog is not None:
+            catalog_design(catalog, func, args, circuit, n, predistort_for, arrange)
+
+        if step is not None:
+            report_step(circuit, step)
+
+        if opamp is not None:
+            report_noise(circuit, noise_bw, opamp, f0)
 
-        circuit, n, f0 = func(sim, args)
-        
         if not filename is None:
             schema = Schematic("A4")
             schema.Add(circuit)
@@ -404,66 +1028,247 @@ if __name__ == "__main__":
 
                 circuit.SetOrigin((-2500, height - 2000))
 
-            add_in_out(schema, circuit, n)
+            add_in_out(schema, circuit, len(getattr(circuit, "stages", [circuit])))
 
             if sim:
                 add_sim_stuffs(schema, f0)
 
-            with open(filename, "w") as file:
-                file.write(schema.ToString())
-                print("\nWrote schematic to %s" % filename)
+            if simplify_wires:
+                with profiling.phase("simplify"):
+                    profiling.count("records removed", simplify(schema))
+
+            for ref, old, new in schema.GetPartsIndex().Duplicates():
+                log.warning("Warning: duplicate reference %s (%s, %s)", ref, old, new)
+
+            written = [filename]
+            with profiling.phase("write"), contextlib.ExitStack() as stack:
+                if sheets:
+                    written = write_sheets(circuit, filename, sim, f0, simplify_wires)
+                    sinks = [ ]
+                else:
+                    sinks = [SchematicSink(stack.enter_context(open_output(filename)))]
+                for sink, name in outputs:
+                    sinks.append(sink(stack.enter_context(open_output(name, ""))))
+                with profiling.phase("serialize"):
+                    export(schema, sinks)
+
+            profiling.count("parts", len(schema.GetPartsIndex().parts))
+            profiling.count("bytes written", sum(os.path.getsize(name) for name in written))
+
+            log.info("\nWrote schematic to %s", filename)
+            if len(written) > 1:
+                log.info("Wrote stage sheets to %s", " ".join(written[1:]))
+            for sink, name in outputs:
+                log.info("Wrote %s to %s", sink.NAME, name)
+
+            # A root sheet is no use without its stage sheets, so isn't cached
+            if key is not None and not sheets:
+                with profiling.phase("cache"):
+                    cache.Store(key, filename, report)
 
         
-    def do_stage(sim, args):
+    def do_stage(sim, args, opamp, arrange = True, stage_type = Lowpass, bandwidth = None):
         f, H0, Q, R1 = map(si_val, args[:4])
 
-        stage = Lowpass((2000, 2000), f, H0, Q, R1,
-                        "MFB LPF: H=%s, Q=%s, f0=%s" % (H0, nsigdig(Q, NQIGITS), f),
-                        True, sim)
+        stage = stage_type((2000, 2000), f, H0, Q, R1,
+                           "MFB %s: H=%s, Q=%s, f0=%s" % (stage_type.ABBREV, H0,
+                                                         nsigdig(Q, NQDIGITS), f),
+                           True, sim, opamp)
 
-        stage.Print("Q=%s" % nsigdig(Q, NQDIGITS))
         return stage, 1, f
         
 
-    def do_butterworth(sim, args):
+    def do_butterworth(sim, args, opamp, arrange = True, stage_type = Lowpass, bandwidth = None):
         f, H0, N, R1 = map(si_val, args[:4])
 
         if N > 32:
-            print("N is too big; you probably didn't mean to do this")
-            exit(1)
+            raise ValueError("N is too big; you probably didn't mean to do this")
 
-        return ButterworthCascade((2000, 2000), f, H0, N, R1, sim), N, f
+        return ButterworthCascade((2000, 2000), f, H0, N, R1, sim, opamp, arrange,
+                                  stage_type, bandwidth), N, f
         
 
-    def do_bessel(si, args):
+    def do_bessel(sim, args, opamp, arrange = True, stage_type = Lowpass, bandwidth = None):
         f, H0, N, R1 = map(si_val, args[:4])
 
         if N > 32:
-            print("N is too big; you probably didn't mean to do this")
-            exit(1)
+            raise ValueError("N is too big; you probably didn't mean to do this")
+
+        return BesselCascade((2000, 2000), f, H0, N, R1, sim, opamp, arrange,
+                             stage_type, bandwidth), N, f
+
+
+    def do_chebyshev(sim, args, opamp, arrange = True, stage_type = Lowpass, bandwidth = None):
+        f, H0, N, R1, ripple = map(si_val, args[:5])
+
+        if N > 32:
+            raise ValueError("N is too big; you probably didn't mean to do this")
 
-        return BesselCascade((2000, 2000), f, H0, N, R1, sim), N, f
+        if not 0 < ripple < 3:
+            raise ValueError("Ripple must be between 0 and 3dB")
+
+        return ChebyshevCascade((2000, 2000), f, H0, N, R1, ripple, sim, opamp,
+                                arrange, stage_type, bandwidth), N, f
+
+
+    def do_linkwitz_riley(sim, args, opamp, arrange = True, stage_type = Lowpass, bandwidth = None):
+        f, H0, N, R1 = map(si_val, args[:4])
+
+        if N > 32:
+            raise ValueError("N is too big; you probably didn't mean to do this")
+
+        return LinkwitzRileyCascade((2000, 2000), f, H0, N, R1, sim, opamp, arrange,
+                                    stage_type, bandwidth), N, f
+
+
+    def do_critical(sim, args, opamp, arrange = True, stage_type = Lowpass, bandwidth = None):
+        f, H0, N, R1 = map(si_val, args[:4])
+
+        if N > 32:
+            raise ValueError("N is too big; you probably didn't mean to do this")
+
+        return CriticallyDampedCascade((2000, 2000), f, H0, N, R1, sim, opamp, arrange,
+                                       stage_type, bandwidth), N, f
+
+
+    # Mode name: (function, number of arguments before the filename)
+    MODES = { "stage":          (do_stage, 4),
+              "butterworth":    (do_butterworth, 4),
+              "bessel":         (do_bessel, 4),
+              "chebyshev":      (do_chebyshev, 5),
+              "linkwitz-riley": (do_linkwitz_riley, 4),
+              "critical":       (do_critical, 4) }
         
 
-    if len(sys.argv) < 2:
-        usage()
+    opts, argv = parse_options(sys.argv[1:])
 
+    # The report goes to stdout, as it always has; --quiet leaves warnings
+    logging.basicConfig(stream=sys.stdout, format="%(message)s",
+                        level=logging.WARNING if "quiet" in opts else logging.INFO)
 
-    what = sys.argv[1]
-    args = sys.argv[2:]
+    catalog = None
+    if "catalog" in opts or "from-catalog" in opts:
+        catalog = Catalog(opts.get("catalog") or CATALOG_PATH)
+
+    if opts.get("from-catalog"):
+        # Rebuild a recorded design: its spec replaces the mode arguments
+        design = catalog.Get(int(opts["from-catalog"]))
+        if design is None:
+            log.error("No design %s in the catalog", opts["from-catalog"])
+            exit(1)
+        argv = ([argv[0]] if argv[:1] == ["sim"] else [ ]) + \
+               [design.spec['mode'].replace("_", "-")] + \
+               [repr(arg) for arg in design.spec['args']] + \
+               [arg for arg in argv if arg != "sim"]
+        if design.spec['predistort'] and not "predistort" in opts:
+            opts["predistort"] = design.spec['predistort']
+        if not design.spec.get('arrange', True):
+            opts["no-arrange"] = ""
+
+    if len(argv) < 1:
+        usage()
+
+    what = argv[0]
+    args = argv[1:]
 
     sim = what == "sim"
     if sim:
         what = args[0]
         args = args[1:]
 
-    if what == "stage" and len(args) >= 4:
-        func = do_stage
-    elif what == "butterworth" and len(args) >= 4:
-        func = do_butterworth
-    elif what == "bessel" and len(args) >= 4:
-        func = do_bessel
-    else:
+    if not what in MODES or len(args) < MODES[what][1]:
         usage()
 
-    do_common(func, args, sim)
+    func, nargs = MODES[what]
+    filename = None
+    if len(args) > nargs:
+        filename = args[nargs]
+    args = args[:nargs]
+
+    cache = None
+    if "cache" in opts:
+        max_bytes = DEFAULT_MAX_BYTES
+        if opts.get("cache-size"):
+            try:
+                max_bytes = parse_size(opts["cache-size"])
+            except ValueError as e:
+                log.error("%s", e)
+                exit(1)
+        cache = SchematicCache(opts["cache"] or ".filtergen-cache", VERSION, SERIALIZER,
+                               max_bytes)
+
+    outputs = [ ]
+    for opt, sink in [("netlist", NetlistSink), ("bom", BOMSink), ("json", JSONSink)]:
+        if opts.get(opt):
+            outputs.append((sink, opts[opt]))
+
+    if "profile" in opts:
+        profiling.enable()
+
+    profiler = None
+    if opts.get("profile"):
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    with profiling.phase("total"):
+        step = None
+        if "step" in opts:
+            step = int(opts["step"] or 0)
+
+        noise_bw = None
+        opamp = None
+        if "noise" in opts:
+            if opts["noise"]:
+                noise_bw = si_val(opts["noise"])
+            opamp = lookup_opamp(opts.get("opamp") or opamps.DEFAULT)
+
+        stage_type = Lowpass
+        bandwidth  = None
+        if "highpass" in opts and "bandpass" in opts:
+            log.error("Pick one of --highpass and --bandpass")
+            exit(1)
+        if "highpass" in opts:
+            stage_type = Highpass
+        if "bandpass" in opts:
+            stage_type = Bandpass
+            if opts["bandpass"]:
+                bandwidth = si_val(opts["bandpass"])
+        if stage_type is not Lowpass:
+            # These model low-pass stages only
+            for opt in ["step", "noise", "predistort", "catalog", "use-vetted",
+                        "from-catalog"]:
+                if opt in opts:
+                    log.error("--%s only works for low-pass filters", opt)
+                    exit(1)
+
+        predistort_for = None
+        if "predistort" in opts:
+            predistort_for = lookup_opamp(opts["predistort"] or opts.get("opamp") or
+                                          opamps.DEFAULT)
+
+        catalog_within = None
+        if "use-vetted" in opts:
+            if catalog is None:
+                log.error("--use-vetted needs --catalog")
+                exit(1)
+            catalog_within = DEFAULT_VETTED_DISTANCE
+            if opts["use-vetted"]:
+                catalog_within = si_val(opts["use-vetted"])
+
+        do_common(func, args, filename, sim, cache, "cache-link" in opts, outputs, step,
+                  noise_bw, opamp, not "no-simplify" in opts, "sheets" in opts, predistort_for,
+                  catalog, not "no-arrange" in opts, stage_type, bandwidth, catalog_within)
+
+    if catalog is not None:
+        catalog.Close()
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(opts["profile"])
+
+    if profiling.enabled:
+        print()
+        profiling.report()
+        if profiler is not None:
+            print("\ncProfile stats written to %s" % opts["profile"])
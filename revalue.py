@@ -0,0 +1,383 @@
+# As-built reports and bulk re-valuing of existing MFB filter schematics
+#
+# Schematics are read back with kicad.parser and their MFB stages found
+# by connectivity rather than by reference, so renumbered or hand edited
+# sheets still work.  Every topology has the same network around its op
+# amp (see rauch.PLACES): one part across the op amp, one from the
+# inverting input to node A, and at A one part to the output, one to
+# ground and one from the stage input.  Which of those are resistors
+# tells the topologies apart; the low-pass stage, for one, has C2 across
+# the op amp, R2 to node A, and R1, C1 and R3 at A.  Stage order follows
+# the signal from each output to the next stage's input.
+
+import os
+import re
+import sys
+import tempfile
+
+import numpy as np
+
+import mfb
+import opamps
+import predistort
+from options import parse_options
+from rauch import STAGES
+from siutils import si_val, sisuffix, nsigdig
+from kicad.schema import Resistor, Capacitor, OpAmp
+from kicad.parser import load, ParseError
+from kicad.export import export, Connectivity, SchematicSink
+from kicad.bom import refkey
+
+NQDIGITS = 4
+
+# Unit suffixes dropped from values, and 4k7 style values
+UNITS = ["ohm", "Ohm", "Ω", "F"]
+RKM_RE = re.compile(r'^(\d+)([pnumkMR])(\d+)$')
+
+
+def parse_value(text):
+    '''Reads a component value such as 4.7k, 4k7, 10nF or 1kohm'''
+    text = text.strip().replace("µ", "u")
+    for unit in UNITS:
+        if text.endswith(unit) and len(text) > len(unit):
+            text = text[0:-len(unit)]
+            break
+
+    m = RKM_RE.match(text)
+    if m is not None:
+        whole, suffix, frac = m.groups()
+        text = "%s.%s%s" % (whole, frac, "" if suffix == "R" else suffix)
+
+    return si_val(text)
+
+
+class Stage(object):
+    '''An MFB stage of a topology found in a schematic.  parts maps the
+    topology's component names (R1, R2, R3, C1 and C2 for low-pass) to
+    components.'''
+
+    def __init__(self, topology, opamp, parts, input, output):
+        self.topology = topology
+        self.opamp    = opamp
+        self.parts    = parts
+        self.input    = input
+        self.output   = output
+
+    def Roles(self):
+        return mfb.components(self.topology)
+
+    def Values(self):
+        '''Returns the component values as floats, in the topology's order'''
+        values = [ ]
+        for role in self.Roles():
+            part = self.parts[role]
+            try:
+                values.append(parse_value(part.GetValue()))
+            except ValueError:
+                raise ValueError("%s has unreadable value '%s'" % (part.GetRef(),
+                                                                   part.GetValue()))
+        return tuple(values)
+
+    def SetValues(self, values):
+        '''Sets new values in the topology's order, formatted like the
+        generator does'''
+        for role, value in zip(self.Roles(), values):
+            if role[0] == "C":
+                self.parts[role].SetValue("%sF" % sisuffix(value))
+            else:
+                self.parts[role].SetValue("%s" % sisuffix(value))
+
+    def Describe(self):
+        return "%s %s: %s" % (self.opamp.GetRef(), STAGES[self.topology].NAME.lower(),
+                              " ".join(self.parts[role].GetRef() for role in self.Roles()))
+
+
+def find_stages(schema):
+    '''Returns the MFB stages of a flat schematic in signal order, and the
+    op amps with an unrecognised network around them'''
+    nets = Connectivity()
+    for item in schema.Walk():
+        nets.Add(item)
+    nets.Resolve()
+
+    # Two terminal parts by net
+    passives = [ ]
+    amps     = [ ]
+    for item, pins in nets.components:
+        nodes = nets.PinNodes(pins)
+        if isinstance(item, OpAmp):
+            amps.append((item, nodes))
+        elif isinstance(item, (Resistor, Capacitor)):
+            passives.append((item, nodes["1"], nodes["2"]))
+    passives.sort(key=lambda p: refkey(p[0].GetRef()))
+
+    def between(kind, a, b, exclude = ()):
+        '''Parts of a kind from net a to net b, or anywhere from a if b is None'''
+        found = [ ]
+        for part, n1, n2 in passives:
+            if not isinstance(part, kind) or part in exclude:
+                continue
+            if n1 == a and (b is None or n2 == b):
+                found.append((part, n2))
+            elif n2 == a and (b is None or n1 == b):
+                found.append((part, n1))
+        return found
+
+    def match(inm, out, kinds):
+        '''The parts around an op amp by place, given the kind of part in
+        each place, or None'''
+        for across, _ in between(kinds["across"], inm, out):
+            for inverting, a in between(kinds["inverting"], inm, None, (across, )):
+                if a == out:
+                    continue
+                feedback = between(kinds["feedback"], a, out, (inverting, ))
+                ground   = between(kinds["ground"], a, "0", (inverting, ))
+                used     = (inverting, ) + tuple(p for p, n in feedback + ground)
+                input    = [(p, n) for p, n in between(kinds["input"], a, None, used)
+                            if n != out and n != "0"]
+                if len(feedback) > 0 and len(ground) > 0 and len(input) > 0:
+                    return { "across": across, "inverting": inverting,
+                             "feedback": feedback[0][0], "ground": ground[0][0],
+                             "input": input[0][0] }, input[0][1]
+        return None
+
+    stages  = [ ]
+    unknown = [ ]
+    for opamp, nodes in sorted(amps, key=lambda o: refkey(o[0].GetRef())):
+        inm, out = nodes["in-"], nodes["out"]
+        if nodes["in+"] != "0":
+            unknown.append(opamp)
+            continue
+
+        for topology, stage_type in STAGES.items():
+            kinds = dict((place, Resistor if name[0] == "R" else Capacitor)
+                         for name, place in stage_type.LAYOUT)
+            found = match(inm, out, kinds)
+            if found is not None:
+                places, input = found
+                parts = dict((name, places[place]) for name, place in stage_type.LAYOUT)
+                stages.append(Stage(topology, opamp, parts, input, out))
+                break
+        else:
+            unknown.append(opamp)
+
+    # Chain the stages from input to output
+    by_input = dict((stage.input, stage) for stage in stages)
+    outputs  = set(stage.output for stage in stages)
+    ordered  = [ ]
+    for stage in stages:
+        if stage.input in outputs:
+            continue
+        while stage is not None and not stage in ordered:
+            ordered.append(stage)
+            stage = by_input.get(stage.output)
+    ordered.extend(stage for stage in stages if not stage in ordered)
+    return ordered, unknown
+
+def as_built(stages, opamp = None):
+    '''Returns (f0, Q, H0) arrays, one entry per stage, with an ideal op
+    amp or the given model, which only handles low-pass stages'''
+    result = np.empty((3, len(stages)))
+    for topology in sorted(set(stage.topology for stage in stages)):
+        which  = [i for i, stage in enumerate(stages) if stage.topology == topology]
+        values = np.array([stages[i].Values() for i in which]).T
+        if opamp is None:
+            result[:, which] = mfb.response(topology, values)
+        elif topology == "lowpass":
+            result[:, which] = predistort.response(*values, opamp)
+        else:
+            raise ValueError("op amp models only handle low-pass stages")
+    return tuple(result)
+
+
+class Revaluation(object):
+    '''Changes to make to each schematic.  assignments maps references to
+    new values and is applied first.  Then, if fscale or r1 is given,
+    every stage is redesigned for its as-built Q and H0 at fscale times
+    its as-built f0, with resistors scaled to R1 = r1 (or the as-built
+    R1).  With an op amp model, responses are those it gives and retuned
+    values are predistorted for it.'''
+
+    def __init__(self, assignments = None, fscale = None, r1 = None, write = True,
+                 opamp = None):
+        self.assignments = assignments or { }
+        self.fscale      = fscale
+        self.r1          = r1
+        self.write       = write
+        self.opamp       = opamp
+
+    def Changes(self):
+        return len(self.assignments) > 0 or self.fscale is not None or self.r1 is not None
+
+    def Retunes(self):
+        return self.fscale is not None or self.r1 is not None
+
+
+def report_lines(stages, f0, Q, H0):
+    lines = [ ]
+    for i, stage in enumerate(stages):
+        lines.append("  stage #%d (%s)  f0 %sHz  Q %s  H0 %s" % (
+            i + 1, stage.Describe(), sisuffix(f0[i]), nsigdig(Q[i], NQDIGITS),
+            nsigdig(H0[i], NQDIGITS)))
+    return lines
+
+def apply_assignments(schema, assignments):
+    '''Sets values by reference.  Returns the references not found.'''
+    missing = dict(assignments)
+    for item in schema.Walk():
+        ref = getattr(item, "GetRef", None) and item.GetRef()
+        if ref in missing:
+            item.SetValue(missing.pop(ref))
+    return sorted(missing.keys(), key=refkey)
+
+def write_schematic(schema, filename):
+    '''Rewrites a schematic in place, atomically'''
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as file:
+            export(schema, [SchematicSink(file)])
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+def process(filename, revaluation):
+    '''Reports on and re-values one schematic.  Returns (report text, ok).'''
+    lines = [ ]
+    try:
+        schema = load(filename)
+
+        if len(revaluation.assignments) > 0:
+            for ref in apply_assignments(schema, revaluation.assignments):
+                lines.append("  warning: no part %s" % ref)
+
+        stages, unknown = find_stages(schema)
+        lines.insert(0, "%s: %d MFB stage%s" % (filename, len(stages),
+                                                "" if len(stages) == 1 else "s"))
+        for opamp in unknown:
+            lines.append("  warning: no MFB stage recognised around %s" % opamp.GetRef())
+        if len(stages) == 0:
+            return "\n".join(lines), True
+
+        f0, Q, H0 = as_built(stages, revaluation.opamp)
+        lines.extend(report_lines(stages, f0, Q, H0))
+
+        if revaluation.Retunes():
+            values = np.array([stage.Values() for stage in stages]).T
+            r1 = values[0] if revaluation.r1 is None else revaluation.r1
+            fscale = 1.0 if revaluation.fscale is None else revaluation.fscale
+            f0 = f0 * fscale
+            if revaluation.opamp is not None:
+                f0, Q, H0, converged = predistort.predistort(f0, Q, H0, r1, revaluation.opamp)
+                for i in np.flatnonzero(~converged):
+                    lines.append("  warning: the %s is too slow for stage #%d" % (
+                        revaluation.opamp.name, i + 1))
+            values = mfb.design([stage.topology for stage in stages], f0, H0, Q, r1)
+            for stage, new in zip(stages, np.array(values).T):
+                stage.SetValues(new)
+
+            lines.append("  retuned:")
+            lines.extend(report_lines(stages, *as_built(stages, revaluation.opamp)))
+
+        if revaluation.Changes() and revaluation.write:
+            write_schematic(schema, filename)
+            lines.append("  wrote %s" % filename)
+    except (OSError, ParseError, ValueError) as e:
+        return "%s: error: %s" % (filename, e), False
+
+    return "\n".join(lines), True
+
+def schematic_files(paths):
+    '''Expands directories into the .sch files below them, sorted'''
+    files = [ ]
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                if name.endswith(".sch") and not name.startswith("_autosave"):
+                    files.append(os.path.join(root, name))
+    return files
+
+def run(files, revaluation, jobs = None):
+    '''Processes files, in parallel unless jobs is 1.  Yields (report, ok)
+    in file order.'''
+    if jobs == 1 or len(files) < 2:
+        for filename in files:
+            yield process(filename, revaluation)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(process, files, [revaluation] * len(files),
+                            chunksize=max(1, len(files) // (4 * (jobs or os.cpu_count() or 1))))
+
+
+if __name__ == "__main__":
+    def usage():
+        progname = os.path.split(sys.argv[0])[-1]
+
+        print("usage:")
+        print("  %s report PATH..." % progname)
+        print("  %s set REF=VALUE[,REF=VALUE...] PATH..." % progname)
+        print("  %s retune [--scale-f=K] [--r1=R1] PATH..." % progname)
+        print()
+        print("options:")
+        print("  --jobs=N      process N files at a time (default: one per CPU)")
+        print("  --dry-run     report the changes without writing any file")
+        print("  --opamp=PART  include the finite gain-bandwidth of PART, and")
+        print("                predistort retuned values for it")
+        print()
+        print("     Finds the MFB low-pass, high-pass and band-pass stages in existing")
+        print("     schematics and reports the f0, Q and H0 their component values give.")
+        print("     Directories are searched for .sch files.  'set' replaces values by")
+        print("     reference; 'retune' recomputes every stage for its as-built Q and H0")
+        print("     with f0 scaled by K and resistors scaled to R1.  Both rewrite the files")
+        print("     in place.  --opamp only handles low-pass stages.")
+        exit(1)
+
+    opts, argv = parse_options(sys.argv[1:])
+
+    if len(argv) < 2 or "help" in opts:
+        usage()
+
+    what  = argv[0]
+    paths = argv[1:]
+    write = not "dry-run" in opts
+
+    opamp = None
+    if opts.get("opamp"):
+        try:
+            opamp = opamps.lookup(opts["opamp"])
+        except ValueError as e:
+            print("error: %s" % e)
+            exit(1)
+
+    if what == "report":
+        revaluation = Revaluation(opamp=opamp)
+    elif what == "set" and len(paths) >= 2:
+        assignments = { }
+        for assignment in paths[0].split(","):
+            ref, sep, value = assignment.partition("=")
+            if sep == "" or ref == "" or value == "":
+                usage()
+            assignments[ref] = value
+        revaluation = Revaluation(assignments, write=write, opamp=opamp)
+        paths = paths[1:]
+    elif what == "retune" and (opts.get("scale-f") or opts.get("r1")):
+        fscale = si_val(opts["scale-f"]) if opts.get("scale-f") else None
+        r1     = si_val(opts["r1"]) if opts.get("r1") else None
+        revaluation = Revaluation(fscale=fscale, r1=r1, write=write, opamp=opamp)
+    else:
+        usage()
+
+    jobs = int(opts["jobs"]) if opts.get("jobs") else None
+
+    ok = True
+    for text, success in run(schematic_files(paths), revaluation, jobs):
+        print(text)
+        ok = ok and success
+
+    exit(0 if ok else 1)
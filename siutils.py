@@ -1,44 +1,115 @@
+import math
+
+import numpy as np
+
 SUFFIXES=["M", "k", "", "m", "u", "n", "p"]
 SUFFIX_MAX = 1e6
 SUFFIX_MIN = 1e-12
 UNSUFFIXED = SUFFIXES.index("")
 
-# Reduce number n to a given number of significant digits m and return as string
+# Decimal exponent of each suffix
+SUFFIX_EXP = dict((suffix, 3 * (UNSUFFIXED - i)) for i, suffix in enumerate(SUFFIXES))
+EXP_SUFFIX = dict((exp, suffix) for suffix, exp in SUFFIX_EXP.items())
+EXP_MAX = SUFFIX_EXP[SUFFIXES[0]]
+EXP_MIN = SUFFIX_EXP[SUFFIXES[-1]]
+
+# We bias a bit in favor of unsuffixed
+UNSUFFIXED_MIN = 0.3
+UNSUFFIXED_MAX = 1300.0
+
+SCALAR_TYPES = (float, int, str)
+
+def isscalar(n):
+    return isinstance(n, SCALAR_TYPES) or not np.iterable(n)
+
+# Reduce number n to a given number of significant digits m and return as string.
+# Trailing zeros are dropped.  Arrays and other iterables give an array of strings.
 def nsigdig(n, m):
-    s = "%s" % n
-    if len(s) > m:
-        s = s[0:m]
-    # drop any trailing period
-    if s[-1] == '.':
-        return s[0:-1]
+    if not isscalar(n):
+        return nsigdig_array(np.asarray(n, dtype=float), m)
+    return nsigdig_scalar(n, m)
+
+def nsigdig_scalar(n, m):
+    s = "%.*g" % (m, float(n))
+    if "e" in s:
+        s = unexponent(float(s), m)
+    return s
+
+def unexponent(n, m):
+    '''Formats an already rounded n in positional notation'''
+    if n == 0 or not math.isfinite(n):
+        return "%g" % n
+
+    decimals = m - 1 - int(math.floor(math.log10(abs(n))))
+    s = "%.*f" % (max(decimals, 0), n)
+    if "." in s:
+        s = s.rstrip("0").rstrip(".")
     return s
 
-# Give a number an SI suffix and return as string
+def nsigdig_array(a, m):
+    s = np.char.mod("%%.%dg" % m, a)
+
+    # %g switches to exponents for large and tiny values; those are rare here
+    exp = np.char.find(s, "e") >= 0
+    if exp.any():
+        s = s.astype(object)
+        s[exp] = [unexponent(float(v), m) for v in s[exp]]
+        s = s.astype(str)
+    return s
+
+# The decimal exponent of the suffix to use for magnitude n > 0.  A suffix
+# is used from a tenth of its unit, so 200k is written 0.2M.
+def suffix_exp(n):
+    exp = 3 * int(math.floor((math.log10(n) + 1) / 3))
+    if n < 10.0 ** (exp - 1):
+        exp -= 3 # log10 rounding
+    return min(max(exp, EXP_MIN), EXP_MAX)
+
+# Give a number an SI suffix and return as string.  Arrays and other
+# iterables give an array of strings.
 def sisuffix(n, ndig=4):
-    # We bias a bit in favor of unsuffixed
-    if n >= 0.3 and n <= 1300.0:
-        return nsigdig(n, ndig)
+    if not isscalar(n):
+        return sisuffix_array(np.asarray(n, dtype=float), ndig)
 
-    wt = SUFFIX_MAX  # Weight of first suffix (M)
-    for suffix in SUFFIXES:
-        if n >= wt/10:
-            return nsigdig(n/wt, ndig) + suffix
-        wt /= 1000
+    mag = abs(n)
+    if (mag >= UNSUFFIXED_MIN and mag <= UNSUFFIXED_MAX) or mag == 0 or not math.isfinite(mag):
+        return nsigdig_scalar(n, ndig)
 
-    # fall back on pico for truly tiny values
-    return "%s%s" % (round(n / SUFFIX_MIN, ndig-1), SUFFIXES[:-1])
+    exp = suffix_exp(mag)
+    return nsigdig_scalar(n / 10.0 ** exp, ndig) + EXP_SUFFIX[exp]
 
-# Parse an SI string with potential suffix
+def sisuffix_array(a, ndig):
+    mag = np.abs(a)
+    finite = np.isfinite(mag) & (mag > 0)
+
+    exp = np.zeros(a.shape, dtype=int)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exp[finite] = 3 * np.floor((np.log10(mag[finite]) + 1) / 3).astype(int)
+    exp[finite & (mag < 10.0 ** (exp - 1))] -= 3
+    exp = np.clip(exp, EXP_MIN, EXP_MAX)
+    exp[(mag >= UNSUFFIXED_MIN) & (mag <= UNSUFFIXED_MAX)] = 0
+
+    suffixes = np.array([EXP_SUFFIX[e] for e in range(EXP_MIN, EXP_MAX + 1, 3)])
+    return np.char.add(nsigdig_array(a / 10.0 ** exp, ndig),
+                       suffixes[(exp - EXP_MIN) // 3])
+
+# Parse an SI string with potential suffix.  Iterables of strings give an
+# array of floats.
 def si_val(s):
+    if not isscalar(s):
+        return np.fromiter((si_val(v) for v in s), dtype=float)
+
     if len(s) < 2:
         return float(s)
 
-    suffix = s[-1]
-    if not suffix in SUFFIXES:
+    exp = SUFFIX_EXP.get(s[-1])
+    if exp is None:
         return float(s)
 
-    pos = UNSUFFIXED - SUFFIXES.index(suffix)
-    return float(s[0:-1]) * (1e3 ** pos)
+    # Dividing keeps e.g. 4.7u the float nearest 4.7e-6
+    if exp < 0:
+        return float(s[0:-1]) / 10.0 ** -exp
+    return float(s[0:-1]) * 10.0 ** exp
 
 # Parse an SI string or percentage of A
 def si_val_or_pct(s, a):
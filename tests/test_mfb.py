@@ -0,0 +1,90 @@
+# Stage design kernels, checked against nodal analysis of the circuits
+
+import numpy as np
+import pytest
+
+import mfb
+import pole
+import rauch
+
+F0 = np.array([20.0, 1e3, 25e3, 100e3])
+Q  = np.array([0.5, 0.7071, 2.0, 10.0])
+H0 = np.array([0.5, 1.0, 2.0, 10.0])
+R1 = 4.7e3
+
+
+def admittances(topology, values, f):
+    '''Admittances (input, feedback, ground, inverting, across) of a stage
+    at frequencies f, by place in the layout'''
+    s = 2j * np.pi * np.asarray(f)[..., None]
+    places = dict((place, name) for name, place in rauch.STAGES[topology].LAYOUT)
+    byname = dict(zip(mfb.components(topology), values))
+    def Y(place):
+        name = places[place]
+        value = byname[name]
+        return 1.0 / value if name[0] == "R" else s * value
+    return [Y(place) for place in ["input", "feedback", "ground", "inverting", "across"]]
+
+def nodal_gain(topology, values, f):
+    '''Vout/Vin with an ideal op amp: the inverting input is a virtual
+    ground, so node A's voltage is -Vout Yacross/Yinverting'''
+    Yin, Yfb, Yg, Yi, Yx = admittances(topology, values, f)
+    return -Yin / ((Yin + Yfb + Yg + Yi) * Yx / Yi + Yfb)
+
+def biquad(topology, f, f0, Q, H0):
+    s = 1j * np.asarray(f)[..., None] / f0
+    numerator = { "lowpass": 1.0, "highpass": s**2, "bandpass": s / Q }[topology]
+    return -H0 * numerator / (s**2 + s / Q + 1.0)
+
+
+@pytest.mark.parametrize("topology", sorted(mfb.TOPOLOGIES))
+def test_response_inverts_design(topology):
+    q = Q if topology != "bandpass" else Q + 2.0 # Keeps H0 under 2Q^2
+    f0, Qr, H = mfb.response(topology, mfb.design(topology, F0, H0, q, R1))
+    assert np.allclose(f0, F0, rtol=1e-12)
+    assert np.allclose(Qr, q, rtol=1e-12)
+    assert np.allclose(H, H0, rtol=1e-12)
+
+@pytest.mark.parametrize("topology", sorted(mfb.TOPOLOGIES))
+def test_transfer_function(topology):
+    q = Q if topology != "bandpass" else Q + 2.0
+    values = mfb.design(topology, F0, H0, q, R1)
+    f = np.logspace(0, 7, 200)
+    assert np.allclose(nodal_gain(topology, values, f), biquad(topology, f, F0, q, H0),
+                       rtol=1e-9, atol=1e-15)
+
+def test_mixed_topologies():
+    topology = np.array(["lowpass", "highpass", "bandpass", "highpass"])
+    values = mfb.design(topology, F0, H0, Q + 2.0, R1)
+    for i, name in enumerate(topology):
+        assert np.allclose(values[:, i], mfb.design(name, F0[i], H0[i], Q[i] + 2.0, R1))
+
+def test_bandpass_gain_limit():
+    with pytest.raises(ValueError):
+        mfb.bandpass_design(1e3, 2.0, 1.0, R1)
+
+def test_bandpass_poles():
+    Qs, fs = pole.bandpass(*pole.butterworth(3), 0.3)
+    assert len(Qs) == 6
+    assert np.isclose(np.prod(fs), 1.0)
+    assert Qs == sorted(Qs)
+
+@pytest.mark.parametrize("arrange", [True, False])
+@pytest.mark.parametrize("H0, BW", [(1.0, 2e3), (10.0, 500.0), (4.0, 200.0)])
+def test_bandpass_cascade_corners(H0, BW, arrange):
+    f0 = 1e3
+    cascade = rauch.ButterworthCascade((0, 0), f0, H0, 2, 1e4, False, None, arrange,
+                                       rauch.Bandpass, BW)
+    b = BW / (2.0 * f0)
+    corners = f0 * (np.sqrt(1.0 + b**2) + np.array([-b, b]))
+    f = np.concatenate([[f0], corners])
+
+    gain = np.ones(len(f), dtype=complex)
+    for stage in cascade.stages:
+        gain *= nodal_gain("bandpass", stage.values, f)[:, 0]
+    gain = np.abs(gain)
+
+    assert np.isclose(gain[0], H0, rtol=1e-9)
+    assert np.allclose(gain[1:], H0 / np.sqrt(2.0), rtol=1e-9)
+    for stage in cascade.stages:
+        assert stage.H0 < 2.0 * stage.Q**2
@@ -0,0 +1,67 @@
+# SI formatting and parsing, scalar and array
+
+import numpy as np
+import pytest
+
+from siutils import nsigdig, sisuffix, si_val, si_val_or_pct
+
+VALUES = [0.0, 1e-13, 1e-12, 4.7e-9, 0.1, 0.3, 1.0, 999.96, 1300.0, 4700.0, 999960.0,
+          2.2e6, 1e12]
+
+
+@pytest.mark.parametrize("value,text", [
+    (999960, "1M"),       # Rounds up into the next suffix
+    (999.96, "1000"),     # Unsuffixed up to 1300
+    (1300.0, "1300"),
+    (1400.0, "1.4k"),
+    (1e-13, "0.1p"),      # Below the smallest suffix
+    (1e-12, "1p"),
+    (0.1, "0.1"),
+    (2.2e6, "2.2M"),
+    (1e12, "1000000M"),   # Above the largest
+    (0.0, "0"),
+])
+def test_sisuffix(value, text):
+    assert sisuffix(value) == text
+
+def test_negative():
+    assert sisuffix(-4700.0) == "-4.7k"
+    assert sisuffix(-1e-13) == "-0.1p"
+    assert nsigdig(-0.012345, 3) == "-0.0123"
+
+def test_nan():
+    assert sisuffix(float("nan")) == "nan"
+    assert nsigdig(float("nan"), 3) == "nan"
+
+def test_nsigdig():
+    assert nsigdig(1234567.0, 3) == "1230000"
+    assert nsigdig(0.70710678, 4) == "0.7071"
+    assert nsigdig(20.0, 3) == "20"
+    assert nsigdig(1e-13, 2) == "0.0000000000001"
+
+@pytest.mark.parametrize("sign", [1.0, -1.0])
+def test_array_matches_scalar(sign):
+    values = sign * np.array(VALUES + [float("nan")])
+    assert list(sisuffix(values)) == [sisuffix(v) for v in values]
+    assert list(nsigdig(values, 4)) == [nsigdig(v, 4) for v in values]
+
+@pytest.mark.parametrize("text,value", [
+    ("1k", 1e3), ("4.7u", 4.7e-6), ("2.2M", 2.2e6), ("33n", 33e-9), ("680p", 680e-12),
+    ("0.5m", 0.5e-3), ("100", 100.0), ("-1.5k", -1500.0), ("1e3", 1e3),
+])
+def test_si_val(text, value):
+    assert si_val(text) == pytest.approx(value, rel=1e-12)
+
+def test_si_val_array():
+    assert list(si_val(["1k", "2M"])) == [1e3, 2e6]
+
+def test_round_trip():
+    # Four significant digits survive formatting and parsing back
+    values = 10.0 ** np.random.default_rng(1).uniform(-12, 6, 1000)
+    parsed = np.array([si_val(sisuffix(v)) for v in values])
+    assert np.allclose(parsed, values, rtol=5e-4, atol=0)
+    assert np.array_equal(si_val(sisuffix(values)), parsed)
+
+def test_si_val_or_pct():
+    assert si_val_or_pct("5%", 1.0) == pytest.approx(0.05)
+    assert si_val_or_pct("2k", 1.0) == 2e3
@@ -0,0 +1,171 @@
+# Step and impulse response of MFB cascades, batched over designs
+#
+# Each stage is the inverting biquad
+#
+#   H(s) = -H0 w0^2 / (s^2 + (w0/Q) s + w0^2)
+#
+# The cascade is assembled into one state-space model per design, which
+# is discretized exactly (zero-order hold) with a batched matrix
+# exponential and stepped through time for all designs at once.  Stage
+# parameters are arrays shaped (designs, stages).
+
+import numpy as np
+
+import mfb
+
+# Settling band as a fraction of the final value
+SETTLE_BAND = 0.02
+NPOINTS = 2000
+
+
+class Response(object):
+    '''Time responses and figures of merit for a batch of designs.
+    Response arrays are (designs, NPOINTS); the step response is
+    normalized to its final value, which is the signed DC gain.'''
+
+    def __init__(self, t, step, impulse, dc_gain):
+        self.t        = t
+        self.step     = step
+        self.impulse  = impulse
+        self.dc_gain  = dc_gain
+
+        self.overshoot     = np.maximum(step.max(axis=1) - 1.0, 0.0) * 100.0 # percent
+        self.rise_time     = crossing(t, step, 0.9) - crossing(t, step, 0.1)
+        self.settling_time = settling(t, step, SETTLE_BAND)
+
+
+def stage_params(circuit):
+    '''Returns (f0, Q, H0) arrays shaped (1, stages) for a Lowpass or Cascade'''
+    stages = getattr(circuit, "stages", [circuit])
+    f0 = np.array([[stage.f0 for stage in stages]])
+    Q  = np.array([[stage.Q for stage in stages]])
+    H0 = np.array([[stage.H0 for stage in stages]])
+    return f0, Q, H0
+
+def state_space(f0, Q, H0):
+    '''Returns batched (A, B, C) for cascades of stages.  States are
+    scaled by w0 so that all of them have the magnitude of the signal.'''
+    f0, Q, H0 = np.broadcast_arrays(*[np.atleast_2d(np.asarray(v, dtype=float))
+                                      for v in (f0, Q, H0)])
+    batch, nstages = f0.shape
+    n  = 2 * nstages
+    w0 = 2.0 * np.pi * f0
+
+    A = np.zeros((batch, n, n))
+    B = np.zeros((batch, n))
+    C = np.zeros((batch, n))
+
+    for k in range(nstages):
+        i = 2 * k
+        A[:, i, i+1]   = w0[:, k]
+        A[:, i+1, i]   = -w0[:, k]
+        A[:, i+1, i+1] = -w0[:, k] / Q[:, k]
+        if k == 0:
+            B[:, i+1] = w0[:, k]
+        else:
+            # Input is the previous stage's output, -H0 z1
+            A[:, i+1, i-2] = -w0[:, k] * H0[:, k-1]
+
+    C[:, n-2] = -H0[:, nstages-1]
+    return A, B, C
+
+def expm(A):
+    '''Batched matrix exponential by scaling and squaring with a [6/6]
+    Pade approximant, which is accurate to double precision for norms
+    up to 1/2'''
+    norm = np.abs(A).sum(axis=-1).max(axis=-1)
+    squarings = int(max(0, np.ceil(np.log2(max(norm.max(), 1e-300) / 0.5))))
+    X = A / 2.0**squarings
+
+    c = [1.0, 1.0/2, 5.0/44, 1.0/66, 1.0/792, 1.0/15840, 1.0/665280]
+    eye = np.broadcast_to(np.eye(A.shape[-1]), A.shape)
+    P = c[0] * eye
+    M = c[0] * eye
+    Xk = eye
+    for k in range(1, len(c)):
+        Xk = Xk @ X
+        P = P + c[k] * Xk
+        M = M + (-1)**k * c[k] * Xk
+
+    E = np.linalg.solve(M, P)
+    for i in range(squarings):
+        E = E @ E
+    return E
+
+def default_duration(f0, Q):
+    '''A window long enough for the slowest stage to settle'''
+    w0 = 2.0 * np.pi * f0
+    # Envelope time constant 2Q/w0 for Q > 1/2, and 1/w0 dominates below
+    tau = np.maximum(2.0 * Q, 1.0) / w0
+    return 12.0 * tau.sum(axis=1)
+
+def simulate(f0, Q, H0, duration = None, npoints = NPOINTS):
+    '''Step and impulse responses for a batch of cascades.  duration is
+    per design, by default long enough for it to settle.'''
+    f0, Q, H0 = np.broadcast_arrays(*[np.atleast_2d(np.asarray(v, dtype=float))
+                                      for v in (f0, Q, H0)])
+    A, B, C = state_space(f0, Q, H0)
+    batch, n = B.shape
+
+    if duration is None:
+        duration = default_duration(f0, Q)
+    dt = np.broadcast_to(np.asarray(duration, dtype=float), (batch,)) / (npoints - 1)
+
+    # Exact discretization of [x' u'] = [[A B] [0 0]] [x u]
+    M = np.zeros((batch, n + 1, n + 1))
+    M[:, :n, :n] = A
+    M[:, :n, n]  = B
+    E  = expm(M * dt[:, None, None])
+    Ad = E[:, :n, :n]
+    Bd = E[:, :n, n]
+
+    step    = np.empty((batch, npoints))
+    impulse = np.empty((batch, npoints))
+    xs = np.zeros((batch, n))
+    xi = B.copy()
+    for k in range(npoints):
+        step[:, k]    = np.einsum('bi,bi->b', C, xs)
+        impulse[:, k] = np.einsum('bi,bi->b', C, xi)
+        xs = np.einsum('bij,bj->bi', Ad, xs) + Bd
+        xi = np.einsum('bij,bj->bi', Ad, xi)
+
+    dc_gain = np.prod(-H0, axis=1)
+    t = dt[:, None] * np.arange(npoints)
+    return Response(t, step / dc_gain[:, None], impulse, dc_gain)
+
+def crossing(t, y, level):
+    '''First time each row of y reaches level, linearly interpolated'''
+    above = y >= level
+    k = np.argmax(above, axis=1)
+    rows = np.arange(y.shape[0])
+    k0 = np.maximum(k - 1, 0)
+    y0, y1 = y[rows, k0], y[rows, k]
+    t0, t1 = t[rows, k0], t[rows, k]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.where(y1 != y0, (level - y0) / (y1 - y0), 0.0)
+    result = t0 + np.clip(frac, 0.0, 1.0) * (t1 - t0)
+    return np.where(above.any(axis=1), result, np.nan)
+
+def settling(t, y, band):
+    '''Time after which each row of y stays within band of 1.  NaN if it
+    hasn't settled by the end of the window.'''
+    outside = np.abs(y - 1.0) > band
+    last = y.shape[1] - 1 - np.argmax(outside[:, ::-1], axis=1)
+    rows = np.arange(y.shape[0])
+    result = t[rows, np.minimum(last + 1, y.shape[1] - 1)]
+    result = np.where(outside.any(axis=1), result, 0.0)
+    return np.where(outside[:, -1], np.nan, result)
+
+def monte_carlo(circuit, runs, r_tol = 0.02, c_tol = 0.05, seed = None):
+    '''Step responses of a design with component values drawn uniformly
+    within tolerance, as mc_analysis does for ngspice'''
+    stages = getattr(circuit, "stages", [circuit])
+    values = np.array([stage.values for stage in stages]).T # (5, stages)
+    tol = np.array([r_tol, r_tol, r_tol, c_tol, c_tol])[:, None, None]
+
+    rng = np.random.default_rng(seed)
+    samples = values[:, None, :] * (1.0 + tol * rng.uniform(-1.0, 1.0, (5, runs, len(stages))))
+
+    f0, Q, H0 = mfb.lowpass_response(*samples)
+    nominal = stage_params(circuit)
+    return simulate(f0, Q, H0, default_duration(nominal[0], nominal[1]) * 1.5)